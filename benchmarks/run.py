@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from benchmarks.shims import read_calls
+from benchmarks.workspace import Workspace
+
+DEFAULT_SIZES = "10,100,500"
+
+
+class Bench:
+    def __init__(self, workspace: Workspace):
+        self.workspace = workspace
+        self.results = []
+
+    def measure(self, name, fn, repeat=1):
+        from devenv.lib import capture_output
+
+        timings = []
+        calls_before = len(read_calls(self.workspace.log_path))
+        for _ in range(repeat):
+            with capture_output():
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+        spawns = len(read_calls(self.workspace.log_path)) - calls_before
+        self.results.append({
+            "operation": name,
+            "size": self.workspace.size,
+            "seconds": min(timings),
+            "spawns": spawns // repeat,
+        })
+
+    def run(self):
+        from devenv.lib import load_config, get_env_root
+        from devenv.commands.pythonpath import PythonPath
+        from devenv.commands.sync import Sync
+
+        config_path = str(self.workspace.config_path)
+        config = load_config(config_path)
+        infer_envs = [e["name"] for e in config.envs.values() if e["pythonpath"] == "infer"]
+
+        def get_env_roots():
+            for directory in self.workspace.nested_dirs():
+                get_env_root(directory)
+
+        def infer():
+            for name in infer_envs:
+                PythonPath(config=config, source_env=name).infer()
+
+        self.measure("load_config", lambda: load_config(config_path), repeat=5)
+        self.measure("get_env_root", get_env_roots, repeat=3)
+        self.measure("sync (cold)", lambda: Sync(config, "all").apply("-"))
+        self.measure("sync (warm)", lambda: Sync(config, "all").apply("-"))
+        self.measure("sync pythonpath", lambda: Sync(config, "all").apply("pythonpath"))
+        self.measure("pythonpath infer", infer)
+        return self.results
+
+
+def run_size(size, latency_scale):
+    with tempfile.TemporaryDirectory(prefix="devenv-bench-") as root:
+        workspace = Workspace(root, size, latency_scale).create()
+        env = os.environ.copy()
+        env.update(workspace.environ)
+        env["PYTHONPATH"] = os.pathsep.join(sys.path)
+        output = subprocess.check_output(
+            [sys.executable, "-m", "benchmarks.run", "single", root, str(size), str(latency_scale)],
+            env=env,
+        )
+    return json.loads(output)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--sizes", default=DEFAULT_SIZES)
+@click.option("--latency-scale", default=0.01, type=float)
+@click.option("--json", "as_json", is_flag=True)
+def run(sizes, latency_scale, as_json):
+    results = []
+    for size in [int(s) for s in sizes.split(",")]:
+        results.extend(run_size(size, latency_scale))
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    click.echo(f"{'operation':<20} {'size':>6} {'seconds':>10} {'spawns':>8}")
+    for r in results:
+        click.echo(f"{r['operation']:<20} {r['size']:>6} {r['seconds']:>10.4f} {r['spawns']:>8}")
+
+
+@cli.command()
+@click.argument("root")
+@click.argument("size", type=int)
+@click.argument("latency_scale", type=float)
+def single(root, size, latency_scale):
+    workspace = Workspace(root, size, latency_scale)
+    click.echo(json.dumps(Bench(workspace).run()))
+
+
+if __name__ == "__main__":
+    cli()
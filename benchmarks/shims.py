@@ -0,0 +1,126 @@
+import os
+import stat
+from pathlib import Path
+
+# seconds, roughly what the real tools take on a warm machine
+LATENCIES = {
+    "pyenv": 0.05,
+    "pyenv_virtualenv": 2.0,
+    "pip": 0.8,
+    "pip_install": 3.0,
+    "poetry": 4.0,
+    "mre": 3.0,
+    "python": 0.03,
+}
+
+PYTHON_VERSION = "3.8.2"
+SITE_PACKAGES = "lib/python3.8/site-packages"
+
+# installs mark the project itself and every name listed in .bench-deps as installed
+_record_install = """
+record_install() {
+    site="$1/%(site_packages)s"
+    mkdir -p "$site"
+    names="$(basename "$PWD")"
+    [ -f .bench-deps ] && names="$names $(cat .bench-deps)"
+    for name in $names; do
+        mkdir -p "$site/$name-0.1.0.dist-info"
+    done
+    touch "$1/bin/$(basename "$PWD")-cli"
+}
+""" % {"site_packages": SITE_PACKAGES}
+
+SHIMS = {
+    "pyenv": """#!/bin/sh
+echo "pyenv $*" >> "$DEVENV_BENCH_LOG"
+versions="$PYENV_ROOT/versions"
+case "$1" in
+    prefix)
+        sleep %(pyenv)s
+        echo "$versions/$2"
+        ;;
+    versions)
+        sleep %(pyenv)s
+        ls "$versions"
+        for v in "$versions"/*/envs/*; do [ -e "$v" ] && echo "${v#$versions/}"; done
+        ;;
+    virtualenv)
+        sleep %(pyenv_virtualenv)s
+        env="$versions/$2/envs/$3"
+        mkdir -p "$env/bin" "$env/%(site_packages)s"
+        printf 'home = %%s\\nversion = %%s\\n' "$versions/$2/bin" "$2" > "$env/pyvenv.cfg"
+        for b in python pip; do ln -s "$DEVENV_BENCH_SHIMS/$b" "$env/bin/$b"; done
+        ln -s "$env" "$versions/$3"
+        ;;
+    virtualenv-delete)
+        sleep %(pyenv)s
+        rm -rf "$(readlink "$versions/$3")" "$versions/$3"
+        ;;
+    local)
+        sleep %(pyenv)s
+        echo "$2" > .python-version
+        ;;
+esac
+""",
+    "pip": """#!/bin/sh
+echo "pip $*" >> "$DEVENV_BENCH_LOG"
+prefix="$(cd "$(dirname "$0")/.." && pwd)"
+%(record_install)s
+case "$1" in
+    install)
+        sleep %(pip_install)s
+        record_install "$prefix"
+        ;;
+    list)
+        sleep %(pip)s
+        echo "[]"
+        ;;
+    *)
+        sleep %(pip)s
+        ;;
+esac
+""",
+    "poetry": """#!/bin/sh
+echo "poetry $*" >> "$DEVENV_BENCH_LOG"
+%(record_install)s
+sleep %(poetry)s
+[ "$1" = "install" ] && record_install "$VIRTUAL_ENV"
+exit 0
+""",
+    "mre": """#!/bin/sh
+echo "mre $*" >> "$DEVENV_BENCH_LOG"
+sleep %(mre)s
+""",
+    "python": """#!/bin/sh
+echo "python $*" >> "$DEVENV_BENCH_LOG"
+sleep %(python)s
+prefix="$(cd "$(dirname "$0")/.." && pwd)"
+case "$1" in
+    --version) echo "Python %(python_version)s" ;;
+    -c) printf '%%s' "$prefix/%(site_packages)s" ;;
+esac
+""",
+}
+
+
+def write_shims(bin_dir, latency_scale=1.0):
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    values = {k: f"{v * latency_scale:.4f}" for k, v in LATENCIES.items()}
+    values.update(
+        site_packages=SITE_PACKAGES,
+        python_version=PYTHON_VERSION,
+        record_install=_record_install,
+    )
+    for name, template in SHIMS.items():
+        path = bin_dir / name
+        path.write_text(template % values)
+        path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return bin_dir
+
+
+def read_calls(log_path):
+    if not os.path.exists(log_path):
+        return []
+    with open(log_path) as f:
+        return [line.rstrip("\n") for line in f]
@@ -0,0 +1,81 @@
+import os
+from pathlib import Path
+
+import yaml
+
+from benchmarks.shims import write_shims, PYTHON_VERSION, SITE_PACKAGES
+
+install_files = {
+    "poetry": {"pyproject.toml": "[tool.poetry]\nname = \"{name}\"\n", "poetry.lock": "# {name}\n"},
+    "pip": {"setup.py": "from setuptools import setup\nsetup(name=\"{name}\")\n"},
+    "requirements": {"requirements.txt": "requests==2.24.0\n"},
+}
+
+
+class Workspace:
+    def __init__(self, root, size, latency_scale=1.0):
+        self.root = Path(root)
+        self.size = size
+        self.latency_scale = latency_scale
+        self.projects_dir = self.root / "projects"
+        self.pyenv_root = self.root / "pyenv"
+        self.shims_dir = self.root / "shims"
+        self.export_dir = self.root / "exported"
+        self.cache_dir = self.root / "cache"
+        self.config_path = self.root / "devenv.yaml"
+        self.log_path = self.root / "calls.log"
+        self.names = [f"proj{i:04d}" for i in range(size)]
+
+    @property
+    def environ(self):
+        return {
+            "PATH": f"{self.shims_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            "PYENV_ROOT": str(self.pyenv_root),
+            "DEVENV_CACHE_DIR": str(self.cache_dir),
+            "DEVENV_EXPORT_DIR": str(self.export_dir),
+            "DEVENV_CONFIG_PATH": str(self.config_path),
+            "DEVENV_BENCH_LOG": str(self.log_path),
+            "DEVENV_BENCH_SHIMS": str(self.shims_dir),
+        }
+
+    def create(self):
+        write_shims(self.shims_dir, self.latency_scale)
+        self.create_base_version()
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        envs = {}
+        for i, name in enumerate(self.names):
+            method = list(install_files)[i % len(install_files)]
+            project_dir = self.projects_dir / name
+            (project_dir / name / "sub").mkdir(parents=True, exist_ok=True)
+            for file_name, content in install_files[method].items():
+                (project_dir / file_name).write_text(content.format(name=name))
+            deps = [self.names[(i + offset) % self.size] for offset in [1, 2] if self.size > offset]
+            (project_dir / ".bench-deps").write_text(" ".join(deps))
+            env = {"version": PYTHON_VERSION}
+            if i % 3 == 0:
+                env["pythonpath"] = "infer"
+            elif i % 3 == 1:
+                env["pythonpath"] = deps
+            if i % 10 == 0:
+                env["export"] = [f"{name}-cli"]
+            envs[str(project_dir)] = env
+        config = {
+            "pythonpath_lookup_dirs": [str(self.projects_dir)],
+            "default_version": PYTHON_VERSION,
+            "envs": envs,
+        }
+        with open(self.config_path, "w") as f:
+            yaml.safe_dump(config, f)
+        return self
+
+    def create_base_version(self):
+        base = self.pyenv_root / "versions" / PYTHON_VERSION
+        (base / SITE_PACKAGES).mkdir(parents=True, exist_ok=True)
+        (base / "bin").mkdir(exist_ok=True)
+        for name in ["python", "pip"]:
+            link = base / "bin" / name
+            if not link.exists():
+                link.symlink_to(self.shims_dir / name)
+
+    def nested_dirs(self):
+        return [self.projects_dir / name / name / "sub" for name in self.names]
@@ -0,0 +1,163 @@
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import click
+
+from devenv.daemon import query, get_socket_path
+from devenv.lib import load_config, get_resolver, get_mtime, Env, describe_env, config_stamp, resolve_includes
+from devenv.res import sitecustomize
+
+actions = ["start", "stop", "status", "run"]
+
+
+class Watched:
+    def __init__(self, stamp_fn, load_fn):
+        self.stamp_fn = stamp_fn
+        self.load_fn = load_fn
+        self.stamp = None
+        self.value = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            stamp = self.stamp_fn()
+            if self.value is None or stamp != self.stamp:
+                self.value = self.load_fn()
+                self.stamp = stamp
+            return self.value
+
+
+class DaemonState:
+    def __init__(self, config_path):
+        self.config_path = os.path.expanduser(config_path)
+        self.resolver = get_resolver()
+        self.config = Watched(self.config_stamp, lambda: load_config(self.config_path))
+        self.versions = Watched(lambda: get_mtime(self.resolver.versions_dir), self.resolver.versions)
+        self.external_site_packages = {}
+
+    def config_stamp(self):
+        # include: fragments are part of the config, and a glob may match new ones
+        paths = [self.config_path]
+        if self.config.value is not None:
+            paths += resolve_includes(self.config_path, self.config.value.raw_config)
+        return config_stamp(paths)
+
+    def handle(self, request):
+        op = request["op"]
+        if op == "ping":
+            return {"pid": os.getpid(), "config_path": self.config_path}
+        if request.get("config_path") and os.path.expanduser(request["config_path"]) != self.config_path:
+            raise ValueError(f"daemon serves {self.config_path}")
+        if op == "versions":
+            return self.versions.get()
+        if op == "pythonpath_show":
+            return self.pythonpath_show(request["env"])
+        if op == "env":
+            # {} rather than None, which the client reads as "no daemon"
+            return describe_env(self.config.get(), request["env"]) or {}
+        raise ValueError(f"Unknown op {op}")
+
+    def pythonpath_show(self, source_env):
+        site_packages = Env.from_name(self.config.get(), source_env).site_packages
+        path = os.path.join(site_packages, "external-site-packages")
+        if path not in self.external_site_packages:
+            self.external_site_packages[path] = Watched(
+                lambda: get_mtime(path), lambda: sitecustomize.read_external_site_packages(path)
+            )
+        return self.external_site_packages[path].get()
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if request["op"] == "shutdown":
+                threading.Thread(target=self.server.shutdown).start()
+                response = {"result": True}
+            else:
+                response = {"result": self.server.state.handle(request)}
+        except Exception as e:
+            response = {"error": str(e) or type(e).__name__}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, config_path, socket_path=None):
+        self.socket_path = socket_path or get_socket_path()
+        self.state = DaemonState(config_path)
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        super().__init__(self.socket_path, DaemonHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+class Daemon:
+    def __init__(self, config):
+        self.config = config
+        self.config_path = config.path or "~/.config/devenv.yaml"
+
+    def status(self):
+        return query("ping")
+
+    def run(self):
+        server = DaemonServer(self.config_path)
+        click.echo(f"Serving {server.state.config_path} on {server.socket_path}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    def start(self):
+        status = self.status()
+        if status:
+            click.echo(click.style(f"Already running [pid {status['pid']}]", fg="magenta"))
+            return
+        subprocess.Popen(
+            [sys.executable, "-m", "devenv.main", "--config-path", self.config_path, "daemon", "run"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        for _ in range(50):
+            status = self.status()
+            if status:
+                click.echo(click.style(f"Started [pid {status['pid']}]", fg="green"))
+                return
+            time.sleep(0.1)
+        raise click.ClickException("daemon did not start")
+
+    def stop(self):
+        if not self.status():
+            click.echo("Not running")
+            return
+        query("shutdown")
+        click.echo(click.style("Stopped", fg="green"))
+
+
+@click.command()
+@click.argument("action", type=click.Choice(actions), nargs=-1)
+@click.pass_obj
+def daemon(config, action):
+    action = action[0] if action else "status"
+    d = Daemon(config)
+    if action == "status":
+        status = d.status()
+        if status:
+            click.echo(f"Running [pid {status['pid']}] serving {status['config_path']} on {get_socket_path()}")
+        else:
+            click.echo("Not running")
+    else:
+        getattr(d, action)()
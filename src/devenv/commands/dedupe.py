@@ -0,0 +1,166 @@
+import fcntl
+import hashlib
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import click
+
+from devenv import completion
+from devenv.lib import Config, DEFAULT_STORE, get_resolver, pyenv_versions
+
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+EXEC_BITS = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+METADATA_SUFFIXES = (".dist-info", ".egg-info")
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_files(directory):
+    stack = [directory]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path, entry.stat(follow_symlinks=False)
+
+
+class FileStore:
+    # stored files are made read-only, so editing one env's copy in place fails instead of
+    # silently changing every env sharing it; pip replaces files rather than rewriting them
+    def __init__(self, path, jobs=8):
+        self.path = Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.jobs = jobs
+        self.verified = set()
+        self.planned = set()
+        self._stored = None
+        self.reclaimed = 0
+        self.linked = 0
+        self.added = 0
+
+    def object_path(self, digest, mode):
+        suffix = "-x" if mode & EXEC_BITS else ""
+        return self.path / digest[:2] / f"{digest}{suffix}"
+
+    def stored_inodes(self):
+        # walked once per store, objects added later are recorded as they are linked in
+        if self._stored is None:
+            self._stored = {(st.st_dev, st.st_ino) for _, st in iter_files(str(self.path))}
+        return self._stored
+
+    def verify(self, object_path, digest):
+        # verify-on-write: an object modified through some other link must not spread further
+        if object_path in self.verified:
+            return True
+        if hash_file(object_path) != digest:
+            object_path.unlink()
+            return False
+        self.verified.add(object_path)
+        return True
+
+    def dedupe(self, site_packages, dry_run=False):
+        # top-level files (.pth, external-site-packages, ...) and metadata get rewritten in place
+        stored = self.stored_inodes()
+        candidates = []
+        for entry in os.scandir(site_packages):
+            if not entry.is_dir(follow_symlinks=False) or entry.name.endswith(METADATA_SUFFIXES):
+                continue
+            candidates.extend(
+                (path, st) for path, st in iter_files(entry.path)
+                if st.st_size and (st.st_dev, st.st_ino) not in stored
+            )
+        with open(self.path / ".lock", "w") as lock, ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            digests = executor.map(lambda candidate: hash_file(candidate[0]), candidates)
+            for (path, st), digest in zip(candidates, digests):
+                self.store(path, st, digest, dry_run)
+
+    def store(self, path, st, digest, dry_run):
+        object_path = self.object_path(digest, st.st_mode)
+        if object_path in self.planned or (object_path.exists() and self.verify(object_path, digest)):
+            self.reclaimed += st.st_blocks * 512
+            self.linked += 1
+            if dry_run:
+                return
+            current = os.lstat(path)
+            if (current.st_ino, current.st_mtime_ns, current.st_size) != (st.st_ino, st.st_mtime_ns, st.st_size):
+                return
+            tmp_path = f"{path}.devenv-tmp"
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            try:
+                os.link(object_path, tmp_path)
+            except OSError:
+                # most likely a different filesystem than the store
+                self.reclaimed -= st.st_blocks * 512
+                self.linked -= 1
+                return
+            os.replace(tmp_path, path)
+            return
+        self.added += 1
+        if dry_run:
+            self.planned.add(object_path)
+            return
+        object_path.parent.mkdir(exist_ok=True)
+        try:
+            os.link(path, object_path)
+        except OSError:
+            self.added -= 1
+            return
+        os.chmod(object_path, stat.S_IMODE(st.st_mode) & ~WRITE_BITS)
+        self.verified.add(object_path)
+        self.stored_inodes().add((st.st_dev, st.st_ino))
+
+    def prune(self, dry_run=False):
+        # objects whose only remaining link is the store itself
+        freed = 0
+        for path, st in list(iter_files(str(self.path))):
+            if st.st_nlink == 1 and not path.endswith(".lock"):
+                freed += st.st_blocks * 512
+                if not dry_run:
+                    os.remove(path)
+        self._stored = None
+        return freed
+
+
+def env_prefixes(names):
+    resolver = get_resolver()
+    if names:
+        return [resolver.prefix(name) for name in names]
+    return [
+        str(resolver.versions_dir / version)
+        for version in pyenv_versions()
+        if version.count("/") == 2 and version.split("/")[1] == "envs"
+    ]
+
+
+@click.command()
+@click.argument("env", nargs=-1, autocompletion=completion.get_pyenv_versions)
+@click.option("--jobs", "-j", default=8, type=click.IntRange(min=1))
+@click.option("--dry-run", is_flag=True)
+@click.pass_obj
+def dedupe(config: Config, env, jobs, dry_run):
+    store = FileStore(config.dedupe_store or DEFAULT_STORE, jobs=jobs)
+    for prefix in env_prefixes(env):
+        site_packages = get_resolver().site_packages(prefix)
+        click.echo(f"Deduplicating {site_packages}")
+        store.dedupe(site_packages, dry_run=dry_run)
+    freed = store.prune(dry_run=dry_run)
+    verb = "Would reclaim" if dry_run else "Reclaimed"
+    click.echo(
+        f"{verb} {store.reclaimed / 1024 / 1024:.1f} MB ({store.linked} files linked, {store.added} stored), "
+        f"pruned {freed / 1024 / 1024:.1f} MB of unused objects"
+    )
@@ -0,0 +1,18 @@
+import json
+
+import click
+
+from devenv import completion
+from devenv.lib import get_and_verify_env, lookup_env
+
+
+@click.command()
+@click.argument("env", required=False, autocompletion=completion.get_pyenv_versions)
+@click.pass_obj
+def env(config, env):
+    env = get_and_verify_env(env)
+    # answered by the daemon when one runs, without loading the config here
+    result = lookup_env(config, env)
+    if result is None:
+        raise click.ClickException(f"{env} is neither a configured env nor a pyenv virtualenv")
+    print(json.dumps(result, indent=2))
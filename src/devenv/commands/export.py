@@ -4,6 +4,7 @@ from pathlib import Path
 import click
 from devenv import completion
 from devenv.lib import get_and_verify_env, Env
+from devenv.trace import tracer
 
 DEVNEV_EXPORT_DIR = os.environ.get("DEVENV_EXPORT_DIR", "~/.local/bin")
 
@@ -13,25 +14,37 @@ class Export:
         self.config = config
         self.source_env = get_and_verify_env(source_env)
         self.export_dir = Path(export_dir).expanduser()
+        self._env = None
 
-    def export(self, bin_name):
-        env = Env.from_name(self.config, self.source_env)
-        bin_path = env.prefix / "bin" / bin_name
+    @property
+    def env(self):
+        # resolved once for all the binaries exported from this env
+        if self._env is None:
+            self._env = Env.from_name(self.config, self.source_env)
+        return self._env
+
+    def plan(self, bin_name):
+        bin_path = self.env.prefix / "bin" / bin_name
         link_path = self.export_dir / bin_name
         if not bin_path.exists():
             raise click.BadParameter(f"{bin_name} do not exists")
         if link_path.exists():
             if link_path.is_symlink():
                 if link_path.resolve() == bin_path.resolve():
-                    click.echo(click.style(f"{bin_name}: Already symlinked", fg='magenta'))
-                else:
-                    click.echo(
-                        click.style(f"{bin_name}: Already symlinked, but to something else [{bin_path}]", fg='yellow'))
-            else:
-                click.echo(click.style(f"{bin_name}: Already exists and is not symlinked", fg='red'))
-            return
-        click.echo(click.style(f"{bin_name}: Creating symlink", fg='green'))
-        link_path.symlink_to(bin_path)
+                    return None, click.style(f"{bin_name}: Already symlinked", fg='magenta'), True
+                return None, click.style(f"{bin_name}: Already symlinked, but to something else [{bin_path}]", fg='yellow'), False
+            return None, click.style(f"{bin_name}: Already exists and is not symlinked", fg='red'), False
+        return (link_path, bin_path), click.style(f"{bin_name}: Creating symlink", fg='green'), False
+
+    def export(self, bin_name, dry_run=False, quiet=False):
+        # quiet only hides the up to date case, conflicts are always reported
+        change, message, up_to_date = self.plan(bin_name)
+        if not (quiet and up_to_date):
+            click.echo(message)
+        if change and not dry_run:
+            link_path, bin_path = change
+            link_path.symlink_to(bin_path)
+        return change
 
 
 @click.command()
@@ -41,4 +54,5 @@ class Export:
 @click.pass_obj
 def export(config, source_env, bin_name, export_dir):
     e = Export(config=config, source_env=source_env, export_dir=export_dir)
-    e.export(bin_name)
+    with tracer.scope(env=e.source_env, phase="export"):
+        e.export(bin_name)
@@ -3,10 +3,19 @@ import os
 
 import click
 
-from devenv import res, completion
-from devenv.lib import get_and_verify_env, is_env_root, Env
+from devenv import res, completion, daemon
+from devenv.lib import (
+    get_and_verify_env,
+    Env,
+    write_atomic,
+    installed_distributions,
+    get_lookup_index,
+    describe_precompile,
+)
+from devenv.res import sitecustomize
+from devenv.trace import tracer
 
-actions = ["add", "remove", "show", "clear", "infer"]
+actions = ["add", "remove", "show", "clear", "infer", "check", "profile"]
 modify_actions = ["add", "remove", "clear"]
 
 
@@ -18,36 +27,124 @@ class PythonPath:
         self.name = self.env_config["name"] if self.env_config else os.path.basename(self.source_env)
         self.source_site_packages = self.get_site_packages(self.source_env)
         self.external_site_packages_path = os.path.join(self.source_site_packages, "external-site-packages")
+        self.manifest_path = f"{self.external_site_packages_path}.manifest"
         self.external_site_packages = self.get_external_site_packages()
 
-    def infer(self):
-        normalize = lambda n: n.lower().replace("-", "_")
-        lookup_dirs = self.config.pythonpath_lookup_dirs
-        name_to_path = {}
-        for lookup_dir in lookup_dirs:
-            for entry in lookup_dir.iterdir():
-                if not is_env_root(entry):
-                    continue
-                name = normalize(entry.name)
-                assert name and name not in name_to_path
-                name_to_path[name] = str(entry.absolute())
-        env = Env.from_name(self.config, self.source_env)
-        installed_packages = [
-            normalize(package["name"]) for package in
-            json.loads(env.pip("list --no-index --format json", out=True))
-        ]
+    def inferred(self):
+        name_to_path = get_lookup_index(tuple(self.config.pythonpath_lookup_dirs))
+        installed_packages = installed_distributions(self.source_site_packages)
         inferred_directories = []
         for installed_package in installed_packages:
             if installed_package == self.name:
                 continue
             if installed_package in name_to_path:
                 inferred_directories.append(name_to_path[installed_package])
-        self.add(inferred_directories)
+        return inferred_directories
+
+    def infer(self):
+        self.add(self.inferred())
+
+    def desired(self, input_envs):
+        if input_envs == "infer":
+            input_envs = self.inferred()
+        desired = []
+        for input_env in input_envs:
+            directory = self.resolve_input_env(input_env)
+            if directory not in desired:
+                desired.append(directory)
+        return desired
+
+    def plan(self, input_envs):
+        desired = self.desired(input_envs)
+        current = self.external_site_packages
+        changes = [f"+ {d}" for d in desired if d not in current]
+        changes += [f"- {d}" for d in current if d not in desired]
+        if not changes and desired != current:
+            changes.append(f"~ reorder {self.external_site_packages_path}")
+        if not os.path.lexists(os.path.join(self.source_site_packages, "sitecustomize.py")):
+            changes.append("+ sitecustomize.py symlink")
+        if not changes and self.manifest_is_stale():
+            changes.append(f"~ rebuild {self.manifest_path}")
+        return desired, changes
+
+    def manifest_is_stale(self):
+        manifest = sitecustomize.read_manifest(self.manifest_path)
+        if not manifest:
+            return True
+        stamps, _, indexed = manifest
+        return sitecustomize.stamp([path for path, _ in stamps]) != stamps or indexed != bool(self.config.use_import_index)
+
+    def reconcile(self, input_envs, dry_run=False):
+        desired, changes = self.plan(input_envs)
+        if changes and not dry_run:
+            self.external_site_packages = desired
+            self.write_external_site_packages()
+            self.verify_sitecustomize_symlink()
+            self.check(verbose=False)
+            self.precompile()
+        return changes
 
     def modify(self, action, input_envs=None):
         self.operate_on_external_site_packages(action, input_envs)
         self.write_external_site_packages()
         self.verify_sitecustomize_symlink()
+        self.check(verbose=False)
+        self.precompile()
+
+    def precompile(self):
+        if not self.config.precompile:
+            return
+        sitedirs, _, _ = sitecustomize.resolve(self.external_site_packages_path)
+        # dirs added by .pth files are the linked envs' editable source trees
+        paths = [operation[1] for operation in sitecustomize.scan(sitedirs) if operation[0] == "path"]
+        linked = {os.path.abspath(d) for d in sitedirs}
+        source_trees = [p for p in paths if os.path.abspath(p) not in linked]
+        summary = Env.from_name(self.config, self.source_env).precompile(sitedirs, source_trees)
+        if summary and summary["compiled"]:
+            click.echo(f"{self.name}: {describe_precompile(summary)}")
+
+    def profile(self, target):
+        import subprocess
+        import tempfile
+
+        env = Env.from_name(self.config, self.source_env)
+        with open(os.path.join(res.DIR, "profile_imports.py")) as f:
+            bootstrap = f.read()
+        final_env = os.environ.copy()
+        final_env.update(self.config.env_vars)
+        final_env["DEVENV_PROFILE"] = "1"
+        final_env.pop("DEVENV_IGNORE_EXTERNAL_SITE_PACKAGES", None)
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            result = subprocess.run(
+                [str(env.prefix / "bin" / "python"), "-X", "importtime", "-c", bootstrap, output.name, target],
+                stderr=subprocess.PIPE,
+                env=final_env,
+            )
+            try:
+                run_info = json.load(output)
+            except ValueError:
+                raise click.ClickException(f"profiling {target} failed:\n{result.stderr.decode()}")
+        sitedirs, _, _ = sitecustomize.resolve(self.external_site_packages_path)
+        directories = [operation[1] for operation in sitecustomize.scan(sitedirs) if operation[0] == "path"]
+        return attribute_import_times(parse_importtime(result.stderr.decode()), run_info, directories)
+
+    def check(self, verbose=True):
+        sitedirs, _, cycles = sitecustomize.resolve(self.external_site_packages_path)
+        if verbose:
+            click.echo("=>   Resolved pythonpath")
+            for sitedir in sitedirs:
+                click.echo(sitedir)
+        for cycle in cycles:
+            click.echo(click.style(f"Skipping link cycle: {' -> '.join(cycle)}", fg="magenta"))
+        shadowed, redundant = find_shadowed(sitecustomize.scan(sitedirs, index_modules=True))
+        if shadowed:
+            click.echo("=>   Shadowed packages")
+            for name, (winner, losers) in sorted(shadowed.items()):
+                click.echo(f"{name}: {winner} shadows {', '.join(losers)}")
+        if redundant:
+            click.echo("=>   Dirs providing only shadowed packages")
+            for directory in redundant:
+                click.echo(directory)
 
     def clear(self):
         self.modify("clear")
@@ -60,10 +157,7 @@ class PythonPath:
             self.external_site_packages = []
             return
         for input_env in input_envs:
-            if os.path.isdir(os.path.expanduser(input_env)):
-                directory = os.path.abspath(os.path.expanduser(input_env))
-            else:
-                directory = self.get_site_packages(input_env) if input_env else None
+            directory = self.resolve_input_env(input_env)
             if action == "remove":
                 self.external_site_packages = [d for d in self.external_site_packages if d != directory]
             elif action == "add":
@@ -72,9 +166,16 @@ class PythonPath:
             else:
                 raise RuntimeError(f"Unknown action {action}")
 
+    def resolve_input_env(self, input_env):
+        if os.path.isdir(os.path.expanduser(input_env)):
+            return os.path.abspath(os.path.expanduser(input_env))
+        return self.get_site_packages(input_env) if input_env else None
+
     def write_external_site_packages(self):
         with open(self.external_site_packages_path, "w") as f:
             f.write("\n".join(self.external_site_packages))
+        manifest = sitecustomize.build_manifest(self.external_site_packages_path, self.config.use_import_index)
+        write_atomic(self.manifest_path, manifest)
 
     def verify_sitecustomize_symlink(self):
         internal_customize_path = os.path.join(res.DIR, "sitecustomize.py")
@@ -83,37 +184,129 @@ class PythonPath:
             os.symlink(internal_customize_path, sitecustomize_path)
 
     def get_external_site_packages(self):
-        current_external = []
-        if os.path.exists(self.external_site_packages_path):
-            with open(self.external_site_packages_path) as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    current_external.append(line)
-        return current_external
+        return sitecustomize.read_external_site_packages(self.external_site_packages_path)
 
     def get_site_packages(self, from_env):
-        env = Env.from_name(self.config, from_env)
-        site_packages = env.python(
-            f'-c "import site, sys; sys.stdout.write(site.getsitepackages()[0])"',
-            out=True,
+        return Env.from_name(self.config, from_env).site_packages
+
+
+def is_namespace_portion(directory, name):
+    path = os.path.join(directory, name)
+    return os.path.isdir(path) and not os.path.exists(os.path.join(path, "__init__.py"))
+
+
+def find_shadowed(operations):
+    providers = {}
+    for operation in operations:
+        if operation[0] == "module":
+            providers.setdefault(operation[1], []).append(operation[2])
+    shadowed = {}
+    for name, directories in providers.items():
+        if len(directories) < 2:
+            continue
+        # a regular package or module anywhere on the path wins over namespace portions
+        regular = [d for d in directories if not is_namespace_portion(d, name)]
+        if regular:
+            shadowed[name] = (regular[0], [d for d in directories if d != regular[0]])
+    provided = {}
+    for name, directories in providers.items():
+        for directory in directories:
+            provided.setdefault(directory, set()).add(name)
+    redundant = [
+        directory for directory, names in provided.items()
+        if all(name in shadowed and shadowed[name][0] != directory for name in names)
+    ]
+    return shadowed, redundant
+
+
+def parse_importtime(stderr):
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return timings
+
+
+def attribute_import_times(timings, run_info, directories):
+    # longest matching external dir wins, everything else is the env itself or the stdlib
+    by_length = sorted(directories, key=len, reverse=True)
+    other = "(env and stdlib)"
+
+    def owner(path):
+        for directory in by_length:
+            if path and path.startswith(directory.rstrip(os.sep) + os.sep):
+                return directory
+        return other
+
+    rows = {d: {"directory": d, "modules": 0, "import_time": 0, "lookups": 0, "lookup_time": 0} for d in directories}
+    rows[other] = {"directory": other, "modules": 0, "import_time": 0, "lookups": 0, "lookup_time": 0}
+    modules = []
+    for name, self_time, cumulative in timings:
+        directory = owner(run_info["modules"].get(name))
+        rows[directory]["modules"] += 1
+        rows[directory]["import_time"] += self_time
+        modules.append({"module": name, "cumulative": cumulative, "self": self_time, "directory": directory})
+    sitecustomize_profile = run_info["sitecustomize"] or {"load_time": 0, "lookups": {}}
+    for path, (count, elapsed) in sitecustomize_profile["lookups"].items():
+        row = rows.get(path, rows[other])
+        row["lookups"] += count
+        row["lookup_time"] += elapsed
+    return {
+        "sitecustomize_time": sitecustomize_profile["load_time"],
+        "elapsed": run_info["elapsed"],
+        "directories": sorted(rows.values(), key=lambda r: r["import_time"] + r["lookup_time"], reverse=True),
+        "slowest_modules": sorted(modules, key=lambda m: m["cumulative"], reverse=True)[:20],
+    }
+
+
+def print_profile(report):
+    click.echo(f"=>   sitecustomize: {report['sitecustomize_time'] * 1000:.1f} ms")
+    click.echo(f"=>   Directories (target took {report['elapsed'] * 1000:.1f} ms)")
+    click.echo(f"{'import ms':>10} {'modules':>8} {'lookups':>8} {'lookup ms':>10}  directory")
+    for r in report["directories"]:
+        click.echo(
+            f"{r['import_time'] * 1000:>10.1f} {r['modules']:>8} {r['lookups']:>8} "
+            f"{r['lookup_time'] * 1000:>10.1f}  {r['directory']}"
         )
-        return site_packages
+    click.echo("=>   Slowest modules")
+    click.echo(f"{'cumul ms':>10} {'self ms':>8}  module")
+    for m in report["slowest_modules"]:
+        click.echo(f"{m['cumulative'] * 1000:>10.1f} {m['self'] * 1000:>8.1f}  {m['module']} [{m['directory']}]")
 
 
 @click.command()
 @click.argument("action", type=click.Choice(actions))
 @click.argument("env", nargs=-1, autocompletion=completion.get_pyenv_versions)
 @click.option("--source-env", "-s", autocompletion=completion.get_pyenv_versions)
+@click.option("--json", "as_json", is_flag=True)
 @click.pass_obj
-def pythonpath(config, action, env, source_env):
+def pythonpath(config, action, env, source_env, as_json):
     if action in modify_actions and action != "clear" and not env:
         raise click.MissingParameter("error: missing env")
-    p = PythonPath(config=config, source_env=source_env)
+    if action == "profile" and len(env) != 1:
+        raise click.UsageError("profile takes exactly one module or script: dev pythonpath profile -- <target>")
     if action == "show":
-        print(json.dumps(p.external_site_packages, indent=2))
-    elif action == "infer":
-        p.infer()
-    else:
-        p.modify(action, env)
+        external_site_packages = daemon.query(
+            "pythonpath_show", env=get_and_verify_env(source_env), config_path=config.path
+        )
+        if external_site_packages is not None:
+            print(json.dumps(external_site_packages, indent=2))
+            return
+    with tracer.scope(env=source_env, phase="pythonpath"):
+        p = PythonPath(config=config, source_env=source_env)
+        if action == "show":
+            print(json.dumps(p.external_site_packages, indent=2))
+        elif action == "infer":
+            p.infer()
+        elif action == "check":
+            p.check()
+        elif action == "profile":
+            report = p.profile(env[0])
+            if as_json:
+                print(json.dumps(report, indent=2))
+            else:
+                print_profile(report)
+        else:
+            p.modify(action, env)
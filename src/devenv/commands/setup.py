@@ -1,32 +1,71 @@
+import fcntl
+import glob
+import hashlib
+import json
 import os
+import shlex
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from inspect import cleandoc
 
 import click
 
-from devenv.lib import run, JDKTableXML, Config, get_env_root, Env, pyenv_versions
+from devenv.lib import (
+    run,
+    JDKTableXML,
+    Config,
+    get_env_root,
+    get_workspace_index,
+    Env,
+    pyenv_versions,
+    describe_precompile,
+    capture_output,
+    get_cache_dir,
+    get_resolver,
+    matrix_env_name,
+)
 from devenv import res, completion
+from devenv.commands.dedupe import FileStore
+from devenv.commands.wheelhouse import Wheelhouse, read_requirement_lines
+from devenv.pythons import PythonBuilds
+from devenv.resolutions import ResolutionCache, referenced_files
+from devenv.templates import EnvTemplates
+from devenv.trace import tracer
 
 IDEA_PREFIX = os.environ.get("DEVENV_IDEA_PREFIX", "PyCharm")
 
 install_methods = ["auto", "pip", "poetry", "mono-repo", "requirements", "raw"]
+fingerprint_files = ["poetry.lock", "pyproject.toml", "setup.py", "setup.cfg", "constraints.txt"]
+fingerprint_patterns = ["*requirements*.txt"]
+FINGERPRINT_FILE = ".devenv-fingerprint"
 
 
 class Setup:
-    def __init__(self, name, version, no_idea, install_method, config: Config, directory, idea_product_prefix=IDEA_PREFIX):
+    def __init__(self, name, version, no_idea, install_method, config: Config, directory, idea_product_prefix=IDEA_PREFIX,
+                 force=False, jdk_table_xml=None, config_name=None, set_local=True):
         self.abs_dir = get_env_root(directory)
         self.name = name or os.path.basename(self.abs_dir)
         self.prefix = None
         self.env = None
+        self.force = force
+        self.install_skipped = False
+        self.install_time = None
         self.no_idea = no_idea or True  # PyCharm integration is currently broken
         self.idea_product_prefix = idea_product_prefix
+        self.jdk_table_xml = jdk_table_xml
+        self.set_local = set_local
         if install_method != "raw":
             self.chdir()
         self.install_method = self.process_install_method(install_method)
         self.config = config
-        self.env_config = config.find_env(self.name)
+        self.env_config = config.find_env(config_name or self.name)
         if self.install_method == "raw" and not self.env_config:
             raise ValueError(f"raw setup requires configuration and none was found for {self.name}")
         self.version = self.process_version(version)
+        self.wheelhouse = Wheelhouse(config.wheelhouse) if config.wheelhouse else None
+        self.resolution_cache = ResolutionCache(config.resolution_cache) if config.resolution_cache else None
 
     def start(self):
         self.create_env()
@@ -39,36 +78,40 @@ class Setup:
         if self.env_config:
             return self.env_config["version"]
         if self.env_exists():
-            env = Env.from_name(self.config, self.name)
-            return env.python("--version", out=True, err=True).split(" ")[1]
+            return Env.from_name(self.config, self.name).python_version
         return self.config.default_version
 
     @staticmethod
     def process_install_method(install_method):
         if install_method != "auto":
             return install_method
-        if os.path.exists("prod-internal-requirements.txt"):
-            install_method = "mono-repo"
-        elif os.path.exists("poetry.lock"):
-            install_method = "poetry"
-        elif os.path.exists("setup.py"):
-            install_method = "pip"
-        elif os.path.exists("requirements.txt"):
-            install_method = "requirements"
-        else:
+        install_method = get_workspace_index().install_method(os.getcwd())
+        if not install_method:
             raise RuntimeError("Can't deduce install method")
         return install_method
 
     def chdir(self):
         os.chdir(self.abs_dir)
 
+    @property
+    def use_template(self):
+        if self.env_config:
+            return self.env_config["template"]
+        return self.config.use_templates
+
     def env_exists(self):
         return self.name in pyenv_versions()
 
     def create_env(self):
         if not self.env_exists():
-            run(f"pyenv virtualenv {self.version} {self.name}")
-        if self.install_method != "raw":
+            PythonBuilds(self.config).ensure([self.version])
+            # a partial version like "3.12" now names an installed 3.12.x
+            self.version = get_resolver().match_version(self.version)
+            if self.use_template:
+                EnvTemplates(self.config).clone(self.version, self.name)
+            else:
+                run(f"pyenv virtualenv {self.version} {self.name}")
+        if self.install_method != "raw" and self.set_local:
             run(f"pyenv local {self.name}")
         self.env = Env.from_name(self.config, self.name)
         self.prefix = str(self.env.prefix)
@@ -84,12 +127,90 @@ class Setup:
         handler = handlers.get(self.install_method)
         if not handler:
             raise ValueError(f"{self.install_method}?")
+        fingerprint = self.compute_fingerprint()
+        if not self.force and fingerprint == self.read_fingerprint():
+            click.echo(click.style(f"{self.name}: Install inputs unchanged, skipping install", fg="magenta"))
+            self.install_skipped = True
+            return
+        start = time.time()
         handler()
         if self.install_method != "raw":
             self.install_raw()
+        self.install_time = time.time() - start
+        self.write_fingerprint(fingerprint)
+        if self.config.precompile:
+            # before dedupe, so identical pycs get shared between envs too
+            source_trees = [self.abs_dir] if self.install_method != "raw" else []
+            summary = self.env.precompile([self.env.site_packages], source_trees)
+            if summary and summary["compiled"]:
+                click.echo(f"{self.name}: {describe_precompile(summary)}")
+        if self.config.dedupe_store:
+            store = FileStore(self.config.dedupe_store)
+            store.dedupe(self.env.site_packages)
+            click.echo(f"{self.name}: linked {store.linked} files from {store.path}")
+
+    @property
+    def install_summary(self):
+        if self.install_skipped:
+            return "install skipped (unchanged)"
+        if self.install_time is not None:
+            return f"installed in {self.install_time:.1f}s"
+        return None
+
+    @property
+    def fingerprint_path(self):
+        return os.path.join(self.prefix, FINGERPRINT_FILE)
+
+    def compute_fingerprint(self):
+        digest = hashlib.sha256()
+        inputs = {
+            "install_method": self.install_method,
+            "python_version": self.env.python_version,
+            "requirements": self.env_config["requirements"] if self.env_config else [],
+        }
+        digest.update(json.dumps(inputs, sort_keys=True).encode())
+        if self.install_method != "raw":
+            requirement_files = [os.path.join(self.abs_dir, "constraints.txt")]
+            for pattern in fingerprint_patterns:
+                requirement_files.extend(sorted(glob.glob(os.path.join(self.abs_dir, pattern))))
+            # nested -r/-c includes, e.g. requirements/base.txt, are install inputs too
+            args = " ".join(f"-r {shlex.quote(path)}" for path in requirement_files)
+            paths = [os.path.join(self.abs_dir, f) for f in fingerprint_files]
+            paths.extend(p for p in referenced_files(args) if p not in paths)
+            for path in paths:
+                if not os.path.isfile(path):
+                    continue
+                digest.update(os.path.relpath(path, self.abs_dir).encode())
+                with open(path, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+        return digest.hexdigest()
+
+    def read_fingerprint(self):
+        if not os.path.exists(self.fingerprint_path):
+            return None
+        with open(self.fingerprint_path) as f:
+            return f.read().strip()
+
+    def write_fingerprint(self, fingerprint):
+        with open(self.fingerprint_path, "w") as f:
+            f.write(fingerprint)
+
+    def pip_install(self, args, requirements=()):
+        if self.wheelhouse:
+            self.wheelhouse.pip_install(self.env, args, requirements)
+        else:
+            self.env.pip(f"install {args}")
+
+    def pip_install_resolved(self, args, requirements=()):
+        # only for requirement sets, an editable install of the checkout can't be replayed from pins
+        if not self.resolution_cache:
+            return self.pip_install(args, requirements)
+        self.resolution_cache.pip_install(self.env, args, requirements, self.pip_install, refresh=self.force)
 
     def install_by_pip(self):
-        self.env.pip("install -e .")
+        # editable installs write egg-info into the checkout, which matrix envs share
+        with source_lock(self.abs_dir):
+            self.pip_install("-e .")
 
     def install_by_poetry(self):
         self.env.poetry("install")
@@ -100,12 +221,14 @@ class Setup:
     def install_requirements(self):
         has_constraints = os.path.exists("constraints.txt")
         has_test_requirements = os.path.exists("test-requirements.txt")
-        command = "install -r requirements.txt"
+        requirement_files = ["requirements.txt"]
+        command = "-r requirements.txt"
         if has_test_requirements:
+            requirement_files.append("test-requirements.txt")
             command = f"{command} -r test-requirements.txt"
         if has_constraints:
             command = f"{command} -c constraints.txt"
-        self.env.pip(command)
+        self.pip_install_resolved(command, read_requirement_lines(requirement_files))
 
     def install_raw(self):
         env_conf = self.env_config
@@ -114,7 +237,7 @@ class Setup:
         requirements = env_conf["requirements"]
         if not requirements:
             return
-        self.env.pip(f"install {' '.join(requirements)}")
+        self.pip_install_resolved(' '.join(requirements), requirements)
 
     def configure_idea(self):
         if self.no_idea:
@@ -166,7 +289,7 @@ class Setup:
             venv_conf = venv_conf.replace("{{version}}", version)
             venv_conf = venv_conf.replace("{{prefix}}", prefix)
 
-        jdk_table_xml = JDKTableXML(self.idea_product_prefix)
+        jdk_table_xml = self.jdk_table_xml or JDKTableXML(self.idea_product_prefix)
         jdk_table_xml_path = jdk_table_xml.path
         if not jdk_table_xml_path:
             click.echo(
@@ -181,11 +304,95 @@ class Setup:
             click.echo(venv_conf)
         else:
             jdk_table_xml.add_entry(raw_entry=venv_conf, entry_name=f"Python {version} ({name})")
-            if jdk_table_xml.dirty:
+            # a shared table is saved once by whoever batched it
+            if jdk_table_xml.dirty and not self.jdk_table_xml:
                 click.echo(f"Updating {jdk_table_xml_path}")
                 jdk_table_xml.save()
 
 
+@contextmanager
+def source_lock(directory):
+    lock_dir = get_cache_dir() / "locks"
+    lock_dir.mkdir(exist_ok=True)
+    with open(lock_dir / f"{hashlib.sha1(directory.encode()).hexdigest()}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _setup_version(kwargs):
+    start = time.time()
+    error = None
+    summary = None
+    with capture_output() as output:
+        try:
+            s = Setup(**kwargs)
+            s.start()
+            summary = s.install_summary
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            traceback.print_exc()
+    return error, summary, output.text, time.time() - start
+
+
+class SetupMatrix:
+    def __init__(self, config: Config, directory, versions, name=None, install_method="auto", force=False, jobs=None):
+        self.config = config
+        self.abs_dir = get_env_root(directory)
+        self.base_name = name or os.path.basename(self.abs_dir)
+        self.versions = versions
+        self.install_method = install_method
+        self.force = force
+        self.jobs = jobs or len(versions)
+        self.results = {}
+
+    def env_name(self, version):
+        return matrix_env_name(self.base_name, version)
+
+    def run(self):
+        resolver = get_resolver()
+        click.echo(f"=>   Setting up {len(self.versions)} versions with {self.jobs} jobs")
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {}
+            for version in self.versions:
+                kwargs = dict(
+                    name=self.env_name(version),
+                    version=resolver.match_version(version),
+                    no_idea=True,
+                    install_method=self.install_method,
+                    config=self.config,
+                    directory=self.abs_dir,
+                    force=self.force,
+                    config_name=self.base_name,
+                    set_local=False,
+                )
+                futures[executor.submit(_setup_version, kwargs)] = version
+            for future in as_completed(futures):
+                version = futures[future]
+                error, summary, output, elapsed = future.result()
+                self.results[version] = (error, summary, elapsed)
+                for line in output.splitlines():
+                    click.echo(f"[{self.env_name(version)}] {line}")
+        succeeded = [self.env_name(v) for v in self.versions if not self.results[v][0]]
+        if succeeded and self.install_method != "raw":
+            # the first one is the default python, the rest provide their pythonX.Y
+            run(f"pyenv local {' '.join(succeeded)}")
+        return self.report()
+
+    def report(self):
+        click.echo("=>   Matrix summary")
+        failures = []
+        for version in self.versions:
+            error, summary, elapsed = self.results[version]
+            if error:
+                failures.append(version)
+            status = f"failed: {error}" if error else (summary or "ok")
+            click.echo(click.style(
+                f"{version:<10} {self.env_name(version):<30} {elapsed:>7.1f}s  {status}",
+                fg="red" if error else "green",
+            ))
+        return failures
+
+
 @click.command()
 @click.argument("version", autocompletion=completion.get_pyenv_versions, nargs=-1)
 @click.option("--install-method", default="auto", type=click.Choice(install_methods))
@@ -193,9 +400,25 @@ class Setup:
 @click.option("--idea-product-prefix", default=IDEA_PREFIX, envvar="DEVENV_IDEA_PREFIX")
 @click.option("--directory", "-d")
 @click.option("--name", "-n")
+@click.option("--force", is_flag=True)
+@click.option("--versions", "matrix", is_flag=True)
+@click.option("--jobs", "-j", type=click.IntRange(min=1))
 @click.pass_obj
-def setup(config, name, version, install_method, no_idea, idea_product_prefix, directory):
-    Setup(
+def setup(config, name, version, install_method, no_idea, idea_product_prefix, directory, force, matrix, jobs):
+    if not version:
+        env_config = config.find_env(name or os.path.basename(get_env_root(directory)))
+        if env_config and env_config["versions"]:
+            matrix, version = True, env_config["versions"]
+    if matrix:
+        if not version:
+            raise click.UsageError("--versions needs at least one version")
+        m = SetupMatrix(config, directory, list(version), name=name, install_method=install_method, force=force,
+                        jobs=jobs)
+        failures = m.run()
+        if failures:
+            raise click.ClickException(f"{len(failures)} version(s) failed: {', '.join(failures)}")
+        return
+    s = Setup(
         name=name,
         version=version[0] if version else None,
         install_method=install_method,
@@ -203,4 +426,9 @@ def setup(config, name, version, install_method, no_idea, idea_product_prefix, d
         idea_product_prefix=idea_product_prefix,
         config=config,
         directory=directory,
-    ).start()
+        force=force,
+    )
+    with tracer.scope(env=s.name, phase="setup"):
+        s.start()
+    if s.install_time is not None:
+        click.echo(f"{s.name}: {s.install_summary}")
@@ -1,27 +1,82 @@
+import os
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
 import click
 
 from devenv.commands import setup, pythonpath, export
-from devenv.lib import Config, get_env_root
+from devenv.lib import Config, JDKTableXML, get_env_root, capture_output
+from devenv.pythons import PythonBuilds
+from devenv.trace import tracer, load_history
 
 actions = ["-", "pythonpath", "setup", "export"]
+steps = ["setup", "pythonpath", "export"]
+step_methods = {
+    "setup": "sync_setup_single",
+    "pythonpath": "sync_pythonpath_single",
+    "export": "sync_exports_single",
+}
+
+StepResult = namedtuple("StepResult", ["status", "output", "elapsed", "error", "detail", "events"])
+
+
+def _run_step(sync, step, path, env_conf, trace=False):
+    cwd = os.getcwd()
+    error = None
+    detail = None
+    if trace:
+        tracer.enable()
+        tracer.reset()
+    start = time.time()
+    with capture_output() as output, tracer.scope(env=env_conf["name"], phase=step):
+        try:
+            detail = getattr(sync, step_methods[step])(path, env_conf)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            traceback.print_exc()
+        finally:
+            os.chdir(cwd)
+    status = "failed" if error else "ok"
+    return StepResult(status, output.text, time.time() - start, error, detail, tracer.events)
 
 
 class Sync:
 
-    def __init__(self, config: Config, directory):
+    def __init__(self, config: Config, directory, jobs=1, force=False, plan=False):
         self.config = config
         self.directory = get_env_root(directory) if directory != "all" else None
+        self.jobs = jobs
+        self.force = force
+        self.plan = plan
+        self.jdk_table_xml = None
 
     def apply(self, action):
-        if action in ["-", "setup"]:
+        # installs are not planned, only the steps whose state is cheap to diff
+        if self.plan and action == "setup":
+            raise click.UsageError("--plan covers the pythonpath and export steps only")
+        if action in ["-", "setup"] and not self.plan:
+            # missing base versions are built up front, in parallel, rather than by each env's setup
+            versions = [conf["version"] for conf in self.selected_envs().values()]
+            PythonBuilds(self.config, jobs=self.jobs).ensure(versions)
+        if self.jobs > 1:
+            return self.apply_parallel(action)
+        if action in ["-", "setup"] and not self.plan:
             self.sync_setup()
         if action in ["-", "pythonpath"]:
             self.sync_pythonpath()
         if action in ["-", "export"]:
             self.sync_exports()
+        return []
 
     def sync_setup(self):
-        self._sync(self.sync_setup_single, "setup")
+        with JDKTableXML.batch(setup.IDEA_PREFIX) as jdk_table_xml:
+            self.jdk_table_xml = jdk_table_xml
+            try:
+                self._sync(self.sync_setup_single, "setup")
+            finally:
+                self.jdk_table_xml = None
 
     def sync_pythonpath(self):
         self._sync(self.sync_pythonpath_single, "pythonpath")
@@ -29,14 +84,134 @@ class Sync:
     def sync_exports(self):
         self._sync(self.sync_exports_single, "export")
 
+    def selected_envs(self):
+        return {
+            path: conf for path, conf in self.config.envs.items()
+            if not self.directory or self.directory == path
+        }
+
     def _sync(self, fn, name):
-        config = self.config
-        directory = self.directory
         click.echo(f"=>   Processing {name}")
-        for path, conf in config.envs.items():
-            if directory and directory != path:
+        details = []
+        for path, conf in self.selected_envs().items():
+            with tracer.scope(env=conf["name"], phase=name):
+                detail = fn(path, conf)
+            if detail:
+                details.append((conf["name"], detail))
+        if details:
+            click.echo(f"=>   {name} report")
+            for env_name, detail in details:
+                click.echo(f"{env_name}: {detail}")
+
+    def build_graph(self, action):
+        envs = self.selected_envs()
+        selected_steps = [s for s in steps if action in ["-", s] and not (self.plan and s == "setup")]
+        graph = {(path, step): set() for path in envs for step in selected_steps}
+        for path, conf in envs.items():
+            if (path, "setup") not in graph:
+                continue
+            for step in ["pythonpath", "export"]:
+                if (path, step) in graph:
+                    graph[(path, step)].add((path, "setup"))
+            if (path, "pythonpath") not in graph or conf["pythonpath"] == "infer":
                 continue
-            fn(path, conf)
+            for input_env in conf["pythonpath"]:
+                target = self.config.find_env_path(input_env)
+                if target and target != path and (target, "setup") in graph:
+                    graph[(path, "pythonpath")].add((target, "setup"))
+        # the manifest follows linked envs' own links, so it is built after theirs are written;
+        # envs linking each other in a cycle keep only the edges that don't close it
+        for path, conf in envs.items():
+            if (path, "pythonpath") not in graph or conf["pythonpath"] == "infer":
+                continue
+            for input_env in conf["pythonpath"]:
+                target = self.config.find_env_path(input_env)
+                node, dep = (path, "pythonpath"), (target, "pythonpath")
+                if target and target != path and dep in graph and not self.reaches(graph, dep, node):
+                    graph[node].add(dep)
+        return graph
+
+    @staticmethod
+    def reaches(graph, start, goal):
+        stack, seen = [start], set()
+        while stack:
+            node = stack.pop()
+            if node == goal:
+                return True
+            if node not in seen:
+                seen.add(node)
+                stack.extend(graph.get(node, ()))
+        return False
+
+    def apply_parallel(self, action):
+        envs = self.config.envs
+        graph = self.build_graph(action)
+        history = load_history()
+        results = {}
+        running = {}
+        click.echo(f"=>   Processing {len(graph)} steps with {self.jobs} jobs")
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            while graph or running:
+                # start the historically slowest steps first to shorten the critical path
+                candidates = sorted(
+                    graph.items(),
+                    key=lambda item: history.get(envs[item[0][0]]["name"], {}).get(item[0][1], 0),
+                    reverse=True,
+                )
+                for node, deps in candidates:
+                    if not deps.issubset(results):
+                        continue
+                    del graph[node]
+                    path, step = node
+                    failed_deps = [d for d in deps if results[d].status != "ok"]
+                    if failed_deps:
+                        names = ", ".join(f"{envs[p]['name']}:{s}" for p, s in sorted(failed_deps))
+                        results[node] = StepResult("skipped", "", 0, f"depends on {names}", None, [])
+                        self.report_step(node, results[node])
+                        continue
+                    future = executor.submit(_run_step, self, step, path, envs[path], tracer.enabled)
+                    running[future] = node
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = running.pop(future)
+                    try:
+                        results[node] = future.result()
+                        tracer.events.extend(results[node].events)
+                    except Exception as e:
+                        results[node] = StepResult("failed", "", 0, str(e) or type(e).__name__, None, [])
+                    self.report_step(node, results[node])
+        return self.report_summary(results)
+
+    def report_step(self, node, result):
+        path, step = node
+        prefix = f"[{self.config.envs[path]['name']}:{step}]"
+        for line in result.output.splitlines():
+            click.echo(f"{prefix} {line}")
+        color = {"ok": "green", "failed": "red", "skipped": "yellow"}[result.status]
+        message = f"{prefix} {result.status} ({result.elapsed:.1f}s)"
+        if result.error:
+            message = f"{message}: {result.error}"
+        click.echo(click.style(message, fg=color))
+
+    def report_summary(self, results):
+        click.echo("=>   Summary")
+        failures = []
+        for path, env_conf in self.selected_envs().items():
+            env_results = {step: results[(path, step)] for step in steps if (path, step) in results}
+            if not env_results:
+                continue
+            name = env_conf["name"]
+            statuses = [
+                f"{step}={result.status}" + (f" ({result.detail})" if result.detail else "")
+                for step, result in env_results.items()
+            ]
+            env_failed = any(r.status != "ok" for r in env_results.values())
+            if env_failed:
+                failures.append(name)
+            click.echo(click.style(f"{name}: {' '.join(statuses)}", fg="red" if env_failed else "green"))
+        return failures
 
     def sync_setup_single(self, path, env_conf):
         name = env_conf["name"]
@@ -44,27 +219,28 @@ class Sync:
         install_method = env_conf["install_method"]
         if install_method == "raw":
             path = name
-        setup.Setup(
+        s = setup.Setup(
             name=name,
             version=env_conf["version"],
             no_idea=install_method == "raw",
             install_method=install_method,
             config=self.config,
             directory=path,
-        ).start()
+            force=self.force,
+            jdk_table_xml=self.jdk_table_xml,
+        )
+        s.start()
+        return s.install_summary
 
     def sync_pythonpath_single(self, _, env_conf):
         if env_conf["install_method"] == "raw":
             return
         source_env = env_conf["name"]
-        input_envs = env_conf["pythonpath"]
-        click.echo(f"===> Processing {source_env} {input_envs}")
         p = pythonpath.PythonPath(config=self.config, source_env=source_env)
-        p.clear()
-        if input_envs == "infer":
-            p.infer()
-        else:
-            p.add(input_envs)
+        changes = p.reconcile(env_conf["pythonpath"], dry_run=self.plan)
+        for change in changes:
+            click.echo(f"{source_env}: {change}")
+        return self.describe_changes(len(changes))
 
     def sync_exports_single(self, _, env_conf):
         exports = env_conf["export"]
@@ -72,17 +248,27 @@ class Sync:
             return
         env_name = env_conf["name"]
         exp = export.Export(config=self.config, source_env=env_name)
-        for e in exports:
-            exp.export(e)
+        changes = [e for e in exports if exp.export(e, dry_run=self.plan, quiet=True)]
+        return self.describe_changes(len(changes))
+
+    def describe_changes(self, count):
+        if not count:
+            return None
+        return f"{count} change(s) {'planned' if self.plan else 'applied'}"
 
 
 @click.command()
 @click.argument("action", type=click.Choice(actions), nargs=-1)
 @click.option("--directory", "-d")
 @click.option("--sync-all", "-a", is_flag=True)
+@click.option("--jobs", "-j", default=1, type=click.IntRange(min=1))
+@click.option("--force", is_flag=True)
+@click.option("--plan", is_flag=True)
 @click.pass_obj
-def sync(config, action, directory, sync_all):
+def sync(config, action, directory, sync_all, jobs, force, plan):
     action = action[0] if action else "-"
     assert not (directory and sync_all)
     directory = directory or (sync_all and "all") or None
-    Sync(config, directory).apply(action)
+    failures = Sync(config, directory, jobs=jobs, force=force, plan=plan).apply(action)
+    if failures:
+        raise click.ClickException(f"{len(failures)} env(s) failed: {', '.join(failures)}")
@@ -1,18 +1,32 @@
 import shutil
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 
 from devenv import completion
 from devenv.commands.setup import IDEA_PREFIX
-from devenv.lib import run, JDKTableXML, extract_venv_version_from_misc_xml, get_env_root, pyenv_versions
+from devenv.lib import (
+    run,
+    Config,
+    JDKTableXML,
+    extract_venv_version_from_misc_xml,
+    get_env_root,
+    get_lookup_index,
+    get_resolver,
+    get_workspace_index,
+    matrix_env_name,
+    pyenv_versions,
+    write_atomic,
+)
 
 
 class TearDown:
-    def __init__(self, directory, version, idea_prefix=IDEA_PREFIX):
+    def __init__(self, directory, version, idea_prefix=IDEA_PREFIX, jdk_table_xml=None):
         self.directory = get_env_root(directory)
         self.version = version
         self.idea_prefix = idea_prefix
+        self.jdk_table_xml = jdk_table_xml
         self.venv_name = os.path.basename(self.directory)
 
     def run(self):
@@ -52,22 +66,160 @@ class TearDown:
     def remove_venv_from_idea(self):
         if not self.version:
             return
-        jdk_table_xml = JDKTableXML(self.idea_prefix)
+        jdk_table_xml = self.jdk_table_xml or JDKTableXML(self.idea_prefix)
         if not jdk_table_xml.path:
             return
         entry_name = f"Python {self.version} ({self.venv_name})"
         jdk_table_xml.remove_entry(entry_name)
-        if not jdk_table_xml.dirty:
+        if not jdk_table_xml.dirty or self.jdk_table_xml:
             return
         click.echo(f"Removing virtualenv from {jdk_table_xml.path}")
         jdk_table_xml.save()
 
 
+def remove_python_versions(python_version_path, names):
+    # `pyenv local a b c` writes one version per line
+    with open(python_version_path) as f:
+        versions = f.read().split()
+    remaining = [v for v in versions if v not in names]
+    if remaining == versions:
+        return
+    if remaining:
+        click.echo(f"Removing {', '.join(v for v in versions if v in names)} from {python_version_path}")
+        write_atomic(python_version_path, "".join(f"{v}\n" for v in remaining))
+    else:
+        click.echo(f"Removing {python_version_path}")
+        os.remove(python_version_path)
+
+
+def directory_size(path):
+    # files with other hardlinks (e.g. cloned from a template) are not freed by deleting this tree
+    own, shared = 0, 0
+    stack = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+                continue
+            st = entry.stat(follow_symlinks=False)
+            if st.st_nlink > 1 and not entry.is_symlink():
+                shared += st.st_blocks * 512
+            else:
+                own += st.st_blocks * 512
+    return own, shared
+
+
+def format_size(size):
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+class BulkTearDown:
+    def __init__(self, config: Config, orphans_only=True, jobs=8, idea_prefix=IDEA_PREFIX):
+        self.config = config
+        self.orphans_only = orphans_only
+        self.jobs = jobs
+        self.idea_prefix = idea_prefix
+        self.resolver = get_resolver()
+
+    def candidates(self):
+        configured = {}
+        for path, conf in self.config.envs.items():
+            configured[conf["name"]] = path
+            # the envs `dev setup` creates for a configured versions: matrix
+            configured.update((matrix_env_name(conf["name"], v), path) for v in conf["versions"])
+        candidates = []
+        for version in pyenv_versions():
+            parts = version.split("/")
+            if len(parts) != 3 or parts[1] != "envs":
+                continue
+            version, _, name = parts
+            if self.orphans_only and name in configured:
+                continue
+            candidates.append({
+                "name": name,
+                "version": version,
+                "prefix": str(self.resolver.versions_dir / version / "envs" / name),
+                "directory": configured.get(name),
+            })
+        return candidates
+
+    def measure(self, candidates):
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            sizes = executor.map(directory_size, [c["prefix"] for c in candidates])
+            for candidate, (own, shared) in zip(candidates, sizes):
+                candidate["size"] = own
+                candidate["shared"] = shared
+
+    def report(self, candidates):
+        for c in sorted(candidates, key=lambda c: c["size"], reverse=True):
+            kind = "configured" if c["directory"] else "orphan"
+            click.echo(
+                f"{format_size(c['size']):>11} {format_size(c['shared']):>11} shared  "
+                f"{c['version']:<10} {kind:<10} {c['name']}"
+            )
+        total = sum(c["size"] for c in candidates)
+        click.echo(f"{len(candidates)} envs, {format_size(total)} to free")
+
+    def delete(self, candidates):
+        def delete_one(candidate):
+            run(f"pyenv virtualenv-delete -f {candidate['name']}")
+            return candidate["name"]
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for name in executor.map(delete_one, candidates):
+                click.echo(click.style(f"Deleted {name}", fg="yellow"))
+
+    def clean_up(self, candidates):
+        names = {c["name"] for c in candidates}
+        directories = {c["directory"] for c in candidates if c["directory"]}
+        index = get_workspace_index()
+        with JDKTableXML.batch(self.idea_prefix) as jdk_table_xml:
+            if jdk_table_xml.path:
+                for c in candidates:
+                    jdk_table_xml.remove_entry(f"Python {c['version']} ({c['name']})")
+            # TearDown walks up to the nearest root, which must be the directory itself
+            for directory in sorted(d for d in directories if index.is_root(d)):
+                t = TearDown(directory, None, self.idea_prefix, jdk_table_xml)
+                t.remove_idea()
+                t.remove_python_version()
+        # other checkouts only lose the deleted names from their .python-version, their .idea is not ours
+        for directory in get_lookup_index(tuple(self.config.pythonpath_lookup_dirs)).values():
+            if directory not in directories and ".python-version" in (index.markers(directory) or []):
+                remove_python_versions(os.path.join(directory, ".python-version"), names)
+
+    def run(self, dry_run=False, yes=False):
+        candidates = self.candidates()
+        if not candidates:
+            click.echo("Nothing to tear down")
+            return
+        self.measure(candidates)
+        self.report(candidates)
+        if dry_run or not (yes or click.confirm("Delete these envs?")):
+            return
+        self.delete(candidates)
+        self.clean_up(candidates)
+
+
 @click.command()
 @click.argument("directory", nargs=-1)
 @click.option("--version", autocompletion=completion.get_pyenv_versions)
 @click.option("--idea-product-prefix", default=IDEA_PREFIX, envvar="DEVENV_IDEA_PREFIX")
-def teardown(version, directory, idea_product_prefix):
+@click.option("--orphans", is_flag=True)
+@click.option("--all", "all_envs", is_flag=True)
+@click.option("--jobs", "-j", default=8, type=click.IntRange(min=1))
+@click.option("--dry-run", is_flag=True)
+@click.option("--yes", "-y", is_flag=True)
+@click.pass_obj
+def teardown(config, version, directory, idea_product_prefix, orphans, all_envs, jobs, dry_run, yes):
+    if orphans or all_envs:
+        if directory:
+            raise click.UsageError("--orphans and --all don't take a directory")
+        BulkTearDown(config, orphans_only=not all_envs, jobs=jobs, idea_prefix=idea_product_prefix).run(dry_run, yes)
+        return
     directory = directory[0] if directory else None
     t = TearDown(directory, version, idea_product_prefix)
     t.run()
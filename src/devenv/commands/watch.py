@@ -0,0 +1,209 @@
+import ctypes
+import fnmatch
+import os
+import select
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import click
+
+from devenv.commands.setup import fingerprint_files, fingerprint_patterns
+from devenv.commands.sync import Sync, StepResult, _run_step
+from devenv.lib import Config, load_config, read_yaml, resolve_includes
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# git checkouts and most editors replace files rather than writing them in place
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self.raise_errno("inotify_init1")
+        self.watches = {}
+
+    @staticmethod
+    def raise_errno(what):
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"{what}: {os.strerror(errno)}")
+
+    def add_watch(self, directory, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            self.raise_errno(f"inotify_add_watch {directory}")
+        self.watches[wd] = directory
+        return wd
+
+    def read(self, timeout=None):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            events.append((self.watches.get(wd), mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def is_install_input(name):
+    return name in fingerprint_files or any(fnmatch.fnmatch(name, p) for p in fingerprint_patterns)
+
+
+class Watch:
+    def __init__(self, config: Config, jobs=2, debounce=1.0):
+        self.config_path = config.path
+        self.config = config
+        self.jobs = jobs
+        self.debounce = debounce
+        self.inotify = Inotify()
+        self.config_files = set()
+        self.pending = {}
+        self.running = {}
+        self.last_event = None
+
+    def watch_all(self):
+        config_files = {self.config_path}
+        if os.path.exists(self.config_path):
+            config_files.update(resolve_includes(self.config_path, read_yaml(self.config_path)))
+        self.config_files = config_files
+        watched = set(self.inotify.watches.values())
+        directories = {os.path.dirname(p) for p in config_files} | set(self.config.envs)
+        for directory in sorted(directories - watched):
+            try:
+                self.inotify.add_watch(directory)
+            except OSError as e:
+                click.echo(click.style(f"Not watching {directory}: {e.strerror}", fg="yellow"))
+        click.echo(f"Watching {len(self.inotify.watches)} directories")
+
+    def reload_config(self):
+        click.echo("Config changed, reloading")
+        self.config = load_config(self.config_path)
+        self.watch_all()
+        # pythonpath and export are reconciled, so scheduling every env is cheap when nothing changed
+        for path in self.config.envs:
+            self.schedule(path, "pythonpath", "export")
+
+    def schedule(self, path, *steps):
+        self.pending.setdefault(path, set()).update(steps)
+        self.last_event = time.monotonic()
+
+    def handle(self, events):
+        config_changed = False
+        for directory, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, assume everything changed
+                for path in self.config.envs:
+                    self.schedule(path, "setup", "pythonpath")
+                continue
+            if directory is None:
+                continue
+            full_path = os.path.join(directory, name)
+            if full_path in self.config_files:
+                config_changed = True
+            elif directory in self.config.envs and is_install_input(name):
+                self.schedule(directory, "setup", "pythonpath")
+        if config_changed:
+            self.reload_config()
+
+    def status(self, path, step, message, color=None):
+        name = self.config.envs[path]["name"]
+        click.echo(click.style(f"[{name}:{step}] {message}", fg=color))
+
+    def submit(self, executor):
+        sync = Sync(self.config, "all")
+        for path in list(self.pending):
+            if path not in self.config.envs:
+                del self.pending[path]
+                continue
+            # one step chain per env at a time, later events wait for the running one
+            if path in self.running.values():
+                continue
+            if len(self.running) >= self.jobs:
+                break
+            requested = self.pending.pop(path)
+            steps = [s for s in ["setup", "pythonpath", "export"] if s in requested]
+            self.status(path, steps[0], "running")
+            future = executor.submit(run_steps, sync, steps, path, self.config.envs[path])
+            self.running[future] = path
+
+    def collect(self, done):
+        for future in done:
+            path = self.running.pop(future)
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [("-", StepResult("failed", "", 0, str(e) or type(e).__name__, None, []))]
+            for step, result in results:
+                if result.status == "failed":
+                    for line in result.output.splitlines():
+                        self.status(path, step, line)
+                color = {"ok": "green", "failed": "red"}[result.status]
+                message = f"{result.status} ({result.elapsed:.1f}s)"
+                if result.error:
+                    message = f"{message}: {result.error}"
+                elif result.detail:
+                    message = f"{message}: {result.detail}"
+                self.status(path, step, message, color)
+
+    def run(self):
+        self.watch_all()
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                while True:
+                    timeout = 0.5
+                    if self.pending:
+                        # a pending env may be waiting on its running chain, so never spin at zero
+                        timeout = max(0.1, self.last_event + self.debounce - time.monotonic())
+                    self.handle(self.inotify.read(timeout))
+                    if self.pending and time.monotonic() - self.last_event >= self.debounce:
+                        self.submit(executor)
+                    if self.running:
+                        done, _ = wait(self.running, timeout=0)
+                        self.collect(done)
+            except KeyboardInterrupt:
+                click.echo("Stopping")
+            finally:
+                self.inotify.close()
+
+
+def run_steps(sync, steps, path, env_conf):
+    results = []
+    for step in steps:
+        result = _run_step(sync, step, path, env_conf)
+        results.append((step, result))
+        if result.status != "ok":
+            break
+    return results
+
+
+@click.command()
+@click.option("--jobs", "-j", default=2, type=click.IntRange(min=1))
+@click.option("--debounce", default=1.0, type=click.FloatRange(min=0))
+@click.pass_obj
+def watch(config, jobs, debounce):
+    if not sys.platform.startswith("linux"):
+        raise click.ClickException("dev watch requires inotify (Linux)")
+    Watch(config, jobs=jobs, debounce=debounce).run()
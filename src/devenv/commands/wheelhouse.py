@@ -0,0 +1,165 @@
+import glob
+import os
+import re
+import shlex
+import subprocess
+from pathlib import Path
+
+import click
+
+from devenv.lib import Config, Env, canonicalize_name, installed_distribution_versions, pyenv_versions
+
+actions = ["show", "prune"]
+
+PINNED_REQUIREMENT = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?\s*==\s*([^\s;,]+)\s*(;.*)?$")
+
+
+def parse_pinned(requirement):
+    match = PINNED_REQUIREMENT.match(requirement.strip())
+    if not match:
+        return None
+    return canonicalize_name(match.group(1)), match.group(3).lower()
+
+
+def parse_wheel_filename(filename):
+    parts = filename[:-len(".whl")].split("-")
+    if len(parts) < 5:
+        return None
+    return canonicalize_name(parts[0]), parts[1].lower()
+
+
+def wheel_tags(filename):
+    # compressed tag sets like py2.py3-none-any expand to one tag per combination
+    parts = filename[:-len(".whl")].split("-")
+    if len(parts) < 5:
+        return set()
+    interpreters, abis, platforms = parts[-3:]
+    return {
+        f"{interpreter}-{abi}-{platform}"
+        for interpreter in interpreters.split(".")
+        for abi in abis.split(".")
+        for platform in platforms.split(".")
+    }
+
+
+def read_requirement_lines(paths):
+    lines = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                line = line.split(" #")[0].strip()
+                if line and not line.startswith("#"):
+                    lines.append(line)
+    return lines
+
+
+class Wheelhouse:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.tags = {}
+
+    def wheels(self):
+        return sorted(self.path.glob("*.whl"))
+
+    def index(self):
+        result = {}
+        for wheel in self.wheels():
+            parsed = parse_wheel_filename(wheel.name)
+            if parsed:
+                result.setdefault(parsed, []).append(wheel)
+        return result
+
+    def supported_tags(self, env: Env):
+        if env.prefix not in self.tags:
+            script = "from pip._vendor.packaging.tags import sys_tags; print(' '.join(map(str, sys_tags())))"
+            try:
+                self.tags[env.prefix] = set(env.python(f"-c {shlex.quote(script)}", out=True).split())
+            except subprocess.CalledProcessError:
+                # without the tags no cached wheel can be trusted, pip wheel decides
+                self.tags[env.prefix] = set()
+        return self.tags[env.prefix]
+
+    def missing(self, requirements, tags):
+        index = self.index()
+        missing = []
+        for requirement in requirements:
+            pinned = parse_pinned(requirement)
+            if pinned and not any(wheel_tags(w.name) & tags for w in index.get(pinned, [])):
+                missing.append(requirement)
+        return missing
+
+    def pip_install(self, env: Env, args, requirements=()):
+        find_links = f"--find-links {shlex.quote(str(self.path))}"
+        requirements = list(requirements)
+        if self.missing(requirements, self.supported_tags(env)):
+            env.pip(f"wheel --wheel-dir {shlex.quote(str(self.path))} {find_links} {args}")
+            # pip wheel built the whole set, dependencies included, for this interpreter
+            env.pip(f"install {find_links} --no-index {args}")
+            return
+        if not requirements or not all(parse_pinned(r) for r in requirements):
+            env.pip(f"install {find_links} {args}")
+            return
+        try:
+            env.pip(f"install {find_links} --no-index {args}")
+        except subprocess.CalledProcessError:
+            # only the top-level pins are checked, a dependency may have been pruned or built for another python
+            click.echo(click.style("Wheelhouse is incomplete for this set, installing from the index", fg="yellow"))
+            env.pip(f"install {find_links} {args}")
+
+    def referenced(self, config: Config):
+        referenced = set()
+        existing_envs = set(pyenv_versions())
+        for path, env_conf in config.envs.items():
+            requirements = list(env_conf["requirements"])
+            if env_conf["install_method"] != "raw":
+                requirement_files = glob.glob(os.path.join(path, "*requirements*.txt"))
+                requirement_files.append(os.path.join(path, "constraints.txt"))
+                requirements.extend(read_requirement_lines(requirement_files))
+            referenced.update(p for p in map(parse_pinned, requirements) if p)
+            if env_conf["name"] in existing_envs:
+                env = Env.from_name(config, env_conf["name"])
+                referenced.update(installed_distribution_versions(env.site_packages))
+        return referenced
+
+    def show(self):
+        wheels = self.wheels()
+        total_size = 0
+        for wheel in wheels:
+            size = wheel.stat().st_size
+            total_size += size
+            click.echo(f"{size / 1024 / 1024:>8.1f} MB  {wheel.name}")
+        click.echo(f"{len(wheels)} wheels, {total_size / 1024 / 1024:.1f} MB in {self.path}")
+
+    def prune(self, config: Config, dry_run=False):
+        referenced = self.referenced(config)
+        freed = 0
+        pruned = 0
+        for key, wheels in self.index().items():
+            if key in referenced:
+                continue
+            for wheel in wheels:
+                freed += wheel.stat().st_size
+                pruned += 1
+                click.echo(click.style(f"Removing {wheel.name}", fg="yellow"))
+                if not dry_run:
+                    wheel.unlink()
+        verb = "Would free" if dry_run else "Freed"
+        click.echo(f"{verb} {freed / 1024 / 1024:.1f} MB ({pruned} wheels)")
+
+
+@click.command()
+@click.argument("action", type=click.Choice(actions), nargs=-1)
+@click.option("--dry-run", is_flag=True)
+@click.pass_obj
+def wheelhouse(config, action, dry_run):
+    action = action[0] if action else "show"
+    if not config.wheelhouse:
+        raise click.UsageError("wheelhouse is not enabled in the configuration")
+    w = Wheelhouse(config.wheelhouse)
+    if action == "show":
+        w.show()
+    else:
+        w.prune(config, dry_run=dry_run)
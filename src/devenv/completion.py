@@ -1,5 +1,9 @@
+from devenv import daemon
 from devenv.lib import pyenv_versions
 
 
 def get_pyenv_versions(incomplete, **_):
-    return [v for v in pyenv_versions() if v.startswith(incomplete)]
+    versions = daemon.query("versions")
+    if versions is None:
+        versions = pyenv_versions()
+    return [v for v in versions if v.startswith(incomplete)]
@@ -0,0 +1,37 @@
+import json
+import os
+
+SOCKET_PATH = os.environ.get(
+    "DEVENV_DAEMON_SOCKET",
+    os.path.join(os.environ.get("DEVENV_CACHE_DIR", "~/.cache/devenv"), "daemon.sock"),
+)
+CLIENT_TIMEOUT = 2.0
+
+
+def get_socket_path():
+    return os.path.expanduser(SOCKET_PATH)
+
+
+def query(op, **params):
+    path = get_socket_path()
+    if os.environ.get("DEVENV_NO_DAEMON") or not os.path.exists(path):
+        return None
+    import socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(CLIENT_TIMEOUT)
+            s.connect(path)
+            s.sendall(json.dumps(dict(params, op=op)).encode() + b"\n")
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = s.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        response = json.loads(data)
+    except (OSError, ValueError):
+        return None
+    if "error" in response:
+        return None
+    return response["result"]
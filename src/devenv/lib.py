@@ -1,44 +1,114 @@
-import subprocess
+import glob
+import hashlib
+import json
+import re
 import os
+import sys
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import click
-import yaml
-from xml.dom.minidom import parse, parseString
+
+from devenv.trace import tracer
 
 
 DEFAULT_VERSION = os.environ.get("DEVENV_DEFAULT_VERSION", "3.8.2")
+PYENV_ROOT = os.environ.get("PYENV_ROOT", "~/.pyenv")
+CACHE_DIR = os.environ.get("DEVENV_CACHE_DIR", "~/.cache/devenv")
+DEFAULT_WHEELHOUSE = os.environ.get("DEVENV_WHEELHOUSE", os.path.join(CACHE_DIR, "wheelhouse"))
+DEFAULT_STORE = os.environ.get("DEVENV_STORE", os.path.join(CACHE_DIR, "store"))
+DEFAULT_RESOLUTION_CACHE = os.environ.get("DEVENV_RESOLUTION_CACHE", os.path.join(CACHE_DIR, "resolutions"))
+DEFAULT_PYTHON_BUILDS = os.environ.get("DEVENV_PYTHON_BUILDS", os.path.join(CACHE_DIR, "python-builds"))
+
+
+def get_cache_dir():
+    path = Path(CACHE_DIR).expanduser()
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def write_atomic(path, content):
+    import tempfile
+
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
 
 
 def extract_venv_version_from_misc_xml(misc_path):
-    dom = parse(misc_path)
-    components = dom.getElementsByTagName("component")
-    for component in components:
-        if component.getAttribute("name") == "ProjectRootManager":
-            entry_name = component.getAttribute("project-jdk-name")
+    from xml.etree import ElementTree
+
+    root = ElementTree.parse(misc_path).getroot()
+    for component in root.iter("component"):
+        if component.get("name") == "ProjectRootManager":
+            entry_name = component.get("project-jdk-name", "")
             if not entry_name.startswith("Python "):
                 continue
             return entry_name[len("Python "):].split(" ")[0]
     return None
 
 
+JDK_ENTRY_PATTERN = re.compile(r"[ \t]*<jdk\b.*?</jdk>[ \t]*\n?", re.DOTALL)
+EMPTY_JDK_TABLE_PATTERN = re.compile(r'^([ \t]*)(<component name="ProjectJdkTable")\s*/>', re.MULTILINE)
+
+
 class JDKTableXML:
     def __init__(self, idea_product_prefix):
         self.idea_product_prefix = idea_product_prefix
         self.path = self.locate_jdk_table_xml()
         self.dirty = False
-        self._dom = None
+        self._content = None
+        self._index = None
+        self._added = {}
+        self._removed = set()
+
+    @classmethod
+    @contextmanager
+    def batch(cls, idea_product_prefix):
+        jdk_table_xml = cls(idea_product_prefix)
+        yield jdk_table_xml
+        if jdk_table_xml.path and jdk_table_xml.dirty:
+            click.echo(f"Updating {jdk_table_xml.path}")
+            jdk_table_xml.save()
 
     @property
-    def dom(self):
-        if not self._dom:
-            self._dom = parse(self.path)
-        return self._dom
+    def content(self):
+        if self._content is None:
+            with open(self.path) as f:
+                self._content = f.read()
+        return self._content
 
     @property
-    def entries(self):
-        return self.dom.getElementsByTagName("component")[0]
+    def index(self):
+        if self._index is None:
+            self._index = self.build_index(self.content)
+        return self._index
+
+    @staticmethod
+    def build_index(content):
+        from xml.etree import ElementTree
+
+        index = {}
+        for match in JDK_ENTRY_PATTERN.finditer(content):
+            name_node = ElementTree.fromstring(match.group().strip()).find("name")
+            name = name_node.get("value") if name_node is not None else None
+            index.setdefault(name, []).append(match.span())
+        return index
 
     def locate_jdk_table_xml(self):
         possible_root_locations = ["~/Library/Application Support/JetBrains"]
@@ -58,50 +128,145 @@ class JDKTableXML:
             if os.path.exists(possibly_jdk_table_xml_path):
                 return possibly_jdk_table_xml_path
 
-    def get_entries(self, entry_name):
-        entries = []
-        for entry in self.entries.getElementsByTagName("jdk"):
-            name_node = entry.getElementsByTagName("name")[0]
-            name = name_node.getAttribute("value")
-            if name == entry_name:
-                entries.append(entry)
-        return entries
-
     def entry_exists(self, entry_name):
-        return bool(self.get_entries(entry_name))
+        if entry_name in self._added:
+            return True
+        return entry_name in self.index and entry_name not in self._removed
 
     def add_entry(self, raw_entry, entry_name):
         if self.entry_exists(entry_name):
             return
-        entry_node = parseString(raw_entry).childNodes[0]
-        self.entries.appendChild(entry_node)
+        self._added[entry_name] = raw_entry
         self.dirty = True
 
     def remove_entry(self, entry_name):
-        entries = self.get_entries(entry_name)
-        if entries:
-            for entry in entries:
-                self.entries.removeChild(entry)
-            self.dirty = True
+        if not self.entry_exists(entry_name):
+            return
+        self._added.pop(entry_name, None)
+        if entry_name in self.index:
+            self._removed.add(entry_name)
+        self.dirty = True
+
+    def render(self, content):
+        index = self.build_index(content)
+        removed_spans = sorted(span for name in self._removed for span in index.get(name, []))
+        added = [raw for name, raw in self._added.items() if name not in index]
+        parts = []
+        position = 0
+        for start, end in removed_spans:
+            parts.append(content[position:start])
+            position = end
+        parts.append(content[position:])
+        result = "".join(parts)
+        if added:
+            result = EMPTY_JDK_TABLE_PATTERN.sub(r"\1\2>\n\1</component>", result)
+            insert_at = result.index("</component>", result.index('<component name="ProjectJdkTable"'))
+            line_start = result.rfind("\n", 0, insert_at) + 1
+            closing_indent = result[line_start:insert_at]
+            if closing_indent.strip():
+                result = f"{result[:insert_at]}\n{result[insert_at:]}"
+                line_start, closing_indent = insert_at + 1, ""
+            existing = JDK_ENTRY_PATTERN.search(result)
+            if existing:
+                indent = existing.group()[:len(existing.group()) - len(existing.group().lstrip())]
+            else:
+                indent = closing_indent + "  "
+            entries = "".join(
+                "".join(f"{indent}{line}\n" for line in raw.strip().splitlines()) for raw in added
+            )
+            result = result[:line_start] + entries + result[line_start:]
+        return result
 
     def save(self):
-        if self.dirty:
-            with open(self.path, "w") as f:
-                f.write(self.dom.toprettyxml())
+        # pending edits are re-applied to the current file under a lock so concurrent writers don't drop entries
+        if not self.dirty:
+            return
+        import fcntl
+
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(self.path) as f:
+                content = f.read()
+            write_atomic(self.path, self.render(content))
+        self.dirty = False
+        self._content = None
+        self._index = None
+        self._added = {}
+        self._removed = set()
 
 
 def run(command, env=None, out=False, err=False):
+    import subprocess
+
     final_env = os.environ.copy()
     final_env.update(env or {})
-    if out or err:
-        kwargs = {
-            # 'stdout': subprocess.STDOUT if out else subprocess.DEVNULL,
-            'stderr': subprocess.STDOUT if err else subprocess.DEVNULL,
-        }
-        return subprocess.check_output(command, shell=True, env=env, **kwargs).decode().strip()
-    else:
-        click.echo(f"Running '{command}'")
-        subprocess.check_call(command, shell=True, env=final_env)
+    with tracer.command(command) as usage:
+        if out or err:
+            kwargs = {
+                # 'stdout': subprocess.STDOUT if out else subprocess.DEVNULL,
+                'stderr': subprocess.STDOUT if err else subprocess.DEVNULL,
+            }
+            if usage is None:
+                return subprocess.check_output(command, shell=True, env=env, **kwargs).decode().strip()
+            process = subprocess.Popen(command, shell=True, env=env, stdout=subprocess.PIPE, **kwargs)
+            output = process.stdout.read()
+            process.stdout.close()
+            _wait_with_usage(process, usage)
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode, command, output)
+            return output.decode().strip()
+        else:
+            click.echo(f"Running '{command}'")
+            if usage is None:
+                subprocess.check_call(command, shell=True, env=final_env)
+                return
+            process = subprocess.Popen(command, shell=True, env=final_env)
+            _wait_with_usage(process, usage)
+            if process.returncode:
+                raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def _wait_with_usage(process, usage):
+    # wait4 reports this child's own rusage, RUSAGE_CHILDREN only has the max over every child so far
+    while True:
+        try:
+            _, status, rusage = os.wait4(process.pid, 0)
+            break
+        except InterruptedError:
+            continue
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    usage["rusage"] = rusage
+
+
+class CapturedOutput:
+    def __init__(self):
+        self.text = ""
+
+    def lines(self):
+        return self.text.splitlines()
+
+
+@contextmanager
+def capture_output():
+    import tempfile
+
+    captured = CapturedOutput()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with tempfile.TemporaryFile() as f:
+        saved_fds = [os.dup(1), os.dup(2)]
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+        try:
+            yield captured
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            for fd, saved_fd in zip([1, 2], saved_fds):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+            f.seek(0)
+            captured.text = f.read().decode(errors="replace")
 
 
 class Env:
@@ -124,19 +289,185 @@ class Env:
         final_env.update(env or {})
         return run(command, final_env, out=out, err=err)
 
+    def precompile(self, directories, checked_hash_directories=()):
+        import shlex
+        from devenv import res
+        from devenv.res import precompile
+
+        # checking freshness here first keeps the common nothing-changed case free of a python spawn
+        version = (self.python_version or "").split(".")
+        cache_tag = f"cpython-{version[0]}{version[1]}" if len(version) > 1 else None
+        directories = [str(d) for d in directories]
+        checked_hash_directories = [str(d) for d in checked_hash_directories]
+        sources, stale = precompile.stale_sources(directories, cache_tag)
+        hashed_sources, hashed_stale = precompile.stale_sources(checked_hash_directories, cache_tag, True)
+        if not stale and not hashed_stale:
+            return {
+                "compiled": 0, "skipped": len(sources) + len(hashed_sources), "failed": 0,
+                "compile_time": 0, "elapsed": 0,
+            }
+        script = os.path.join(res.DIR, "precompile.py")
+        quoted = " ".join(shlex.quote(d) for d in directories)
+        if checked_hash_directories:
+            quoted = f"{quoted} --checked-hash {' '.join(shlex.quote(d) for d in checked_hash_directories)}"
+        try:
+            return json.loads(self.python(f"{script} {quoted}", out=True))
+        except Exception:
+            # precompiling is an optimization, a broken interpreter will surface elsewhere
+            return None
+
+    @property
+    def site_packages(self):
+        return get_resolver().site_packages(self.prefix)
+
+    @property
+    def python_version(self):
+        return get_resolver().python_version(self.prefix)
+
     @classmethod
     def from_name(cls, config, name):
+        return cls(config, get_resolver().prefix(name))
+
+
+def describe_precompile(summary):
+    return (
+        f"compiled {summary['compiled']} files in {summary['elapsed']:.1f}s "
+        f"({summary['skipped']} unchanged, {summary['failed']} failed), "
+        f"saving ~{summary['compile_time']:.1f}s of compilation on next startup"
+    )
+
+
+class Resolver:
+    def __init__(self, pyenv_root=PYENV_ROOT, cache_path=None):
+        self.versions_dir = Path(pyenv_root).expanduser() / "versions"
+        self.cache_path = Path(cache_path) if cache_path else get_cache_dir() / "resolution-cache.json"
+        self._cache = None
+
+    @property
+    def cache(self) -> dict:
+        if self._cache is None:
+            self._cache = self.load_cache()
+        return self._cache
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"prefixes": {}, "envs": {}}
+
+    def save_cache(self):
+        merged = self.load_cache()
+        for section, entries in self.cache.items():
+            merged.setdefault(section, {}).update(entries)
+        write_atomic(self.cache_path, json.dumps(merged))
+
+    def versions(self) -> List[str]:
+        if not self.versions_dir.is_dir():
+            return [v.strip() for v in run("pyenv versions --bare", out=True).split("\n")]
+        versions = []
+        for entry in os.scandir(self.versions_dir):
+            versions.append(entry.name)
+            envs_dir = os.path.join(entry.path, "envs")
+            if not entry.is_symlink() and os.path.isdir(envs_dir):
+                versions.extend(f"{entry.name}/envs/{name}" for name in os.listdir(envs_dir))
+        return sorted(versions, key=version_sort_key)
+
+    def prefix(self, name):
         if name.startswith("/"):
-            prefix = name
-        else:
-            prefix = run(f"pyenv prefix {name}", out=True)
-        return cls(config, prefix)
+            return name
+        candidate = self.versions_dir / name
+        if candidate.is_dir():
+            return str(candidate)
+        stamp = get_mtime(self.versions_dir)
+        cached = self.cache["prefixes"].get(name)
+        if cached and cached["stamp"] == stamp:
+            return cached["prefix"]
+        prefix = run(f"pyenv prefix {name}", out=True)
+        self.cache["prefixes"][name] = {"stamp": stamp, "prefix": prefix}
+        self.save_cache()
+        return prefix
+
+    def match_version(self, version):
+        # "3.8" means the newest installed 3.8.x, anything unmatched is passed through as is
+        candidates = [
+            v for v in self.versions()
+            if re.match(r"^\d+(\.\d+)*$", v) and (v == version or v.startswith(f"{version}."))
+        ]
+        return max(candidates, key=version_sort_key) if candidates else version
+
+    def python_version(self, prefix):
+        return self.resolve_env(prefix)["version"]
+
+    def site_packages(self, prefix):
+        return self.resolve_env(prefix)["site_packages"]
+
+    def resolve_env(self, prefix):
+        prefix = str(prefix)
+        stamp = [get_mtime(prefix), get_mtime(os.path.join(prefix, "lib"))]
+        cached = self.cache["envs"].get(prefix)
+        if cached and cached["stamp"] == stamp:
+            return cached
+        resolved = {
+            "stamp": stamp,
+            "version": self.read_python_version(prefix),
+            "site_packages": self.read_site_packages(prefix),
+        }
+        self.cache["envs"][prefix] = resolved
+        self.save_cache()
+        return resolved
+
+    @staticmethod
+    def read_python_version(prefix):
+        pyvenv_cfg = os.path.join(prefix, "pyvenv.cfg")
+        if os.path.exists(pyvenv_cfg):
+            with open(pyvenv_cfg) as f:
+                for line in f:
+                    key, _, value = line.partition("=")
+                    match = re.match(r"\d+\.\d+(\.\d+)?", value.strip())
+                    if key.strip() in ["version", "version_info"] and match:
+                        return match.group(0)
+        name = os.path.basename(prefix)
+        if re.match(r"^\d+\.\d+\.\d+$", name):
+            return name
+        return run(f"{prefix}/bin/python --version", out=True, err=True).split(" ")[1]
+
+    @staticmethod
+    def read_site_packages(prefix):
+        lib_dir = os.path.join(prefix, "lib")
+        if os.path.isdir(lib_dir):
+            candidates = [
+                os.path.join(lib_dir, d, "site-packages") for d in os.listdir(lib_dir)
+                if d.startswith("python")
+            ]
+            candidates = [c for c in candidates if os.path.isdir(c)]
+            if len(candidates) == 1:
+                return candidates[0]
+        return run(
+            f'{prefix}/bin/python -c "import site, sys; sys.stdout.write(site.getsitepackages()[0])"',
+            out=True,
+        )
+
+
+def version_sort_key(version):
+    return [(0, int(p), "") if p.isdigit() else (1, 0, p) for p in re.split(r"(\d+)", version)]
+
+
+_resolver = None
+
+
+def get_resolver():
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver()
+    return _resolver
 
 
 class Config:
-    def __init__(self, raw_config):
+    def __init__(self, raw_config, path=None, preprocessed=None):
         self.raw_config = raw_config or {}
-        self.config = self.preprocess_config(self.raw_config)
+        self.path = path
+        self.config = preprocessed or self.preprocess_config(self.raw_config)
 
     def preprocess_config(self, config):
         result = config.copy()
@@ -156,17 +487,27 @@ class Config:
                 "pythonpath": [],
                 "requirements": [],
                 "export": [],
+                "template": self.use_templates,
+                # only read by `dev setup`, sync keeps managing the single unsuffixed env
+                "versions": [],
             }
             for default_key, default_value in defaults.items():
                 v.setdefault(default_key, default_value)
             result["envs"][k] = v
+        result["name_index"] = {}
+        for k, v in result["envs"].items():
+            result["name_index"].setdefault(v["name"], k)
         return result
 
     def find_env(self, name):
-        for env in self.envs.values():
-            if env["name"] == name:
-                return env
-        return None
+        path = self.config["name_index"].get(name)
+        return self.envs[path] if path else None
+
+    def find_env_path(self, name_or_path):
+        path = os.path.abspath(os.path.expanduser(name_or_path))
+        if path in self.envs:
+            return path
+        return self.config["name_index"].get(name_or_path)
 
     @property
     def envs(self) -> dict:
@@ -188,21 +529,215 @@ class Config:
     def default_install_method(self) -> str:
         return self.raw_config.get("default_install_method", "auto")
 
+    @property
+    def use_templates(self) -> bool:
+        return self.raw_config.get("use_templates", False)
+
+    @property
+    def precompile(self) -> bool:
+        return self.raw_config.get("precompile", True)
+
+    @property
+    def use_import_index(self) -> bool:
+        return self.raw_config.get("use_import_index", False)
+
+    @property
+    def template_requirements(self) -> List[str]:
+        return self.raw_config.get("template_requirements", [])
+
+    @property
+    def wheelhouse(self) -> Optional[Path]:
+        wheelhouse = self.raw_config.get("wheelhouse")
+        if not wheelhouse:
+            return None
+        if wheelhouse is True:
+            wheelhouse = DEFAULT_WHEELHOUSE
+        return Path(wheelhouse).expanduser()
+
+    @property
+    def resolution_cache(self) -> Optional[Path]:
+        resolution_cache = self.raw_config.get("resolution_cache")
+        if not resolution_cache:
+            return None
+        if resolution_cache is True:
+            resolution_cache = DEFAULT_RESOLUTION_CACHE
+        return Path(resolution_cache).expanduser()
+
+    @property
+    def python_builds(self) -> Optional[Path]:
+        # on by default, `python_builds: false` leaves missing versions to the user
+        python_builds = self.raw_config.get("python_builds", True)
+        if not python_builds:
+            return None
+        if python_builds is True:
+            python_builds = DEFAULT_PYTHON_BUILDS
+        return Path(python_builds).expanduser()
+
+    @property
+    def dedupe_store(self) -> Optional[Path]:
+        store = self.raw_config.get("dedupe")
+        if not store:
+            return None
+        if store is True:
+            store = DEFAULT_STORE
+        return Path(store).expanduser()
+
+
+class LazyConfig(Config):
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._loaded = None
+
+    def load(self) -> Config:
+        if self._loaded is None:
+            self._loaded = load_config(self.path)
+        return self._loaded
+
+    @property
+    def raw_config(self):
+        return self.load().raw_config
+
+    @property
+    def config(self):
+        return self.load().config
+
+
+def read_yaml(path):
+    import yaml
+
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(path) as f:
+        return yaml.load(f, Loader=loader) or {}
+
+
+def resolve_includes(config_path, raw_config):
+    base_dir = os.path.dirname(config_path)
+    paths = []
+    for pattern in raw_config.get("include", []):
+        paths.extend(sorted(glob.glob(os.path.join(base_dir, os.path.expanduser(pattern)))))
+    return paths
+
+
+def merge_fragments(raw_config, fragment_paths):
+    # env paths and lookup dirs in a fragment are relative to the fragment itself
+    raw_config = dict(raw_config)
+    raw_config["envs"] = dict(raw_config.get("envs") or {})
+    raw_config["env_vars"] = dict(raw_config.get("env_vars") or {})
+    raw_config["pythonpath_lookup_dirs"] = list(raw_config.get("pythonpath_lookup_dirs") or [])
+    for fragment_path in fragment_paths:
+        fragment = read_yaml(fragment_path)
+        base_dir = os.path.dirname(fragment_path)
+        for k, v in (fragment.get("envs") or {}).items():
+            raw_config["envs"][os.path.join(base_dir, os.path.expanduser(k))] = v
+        for lookup_dir in fragment.get("pythonpath_lookup_dirs") or []:
+            raw_config["pythonpath_lookup_dirs"].append(os.path.join(base_dir, os.path.expanduser(lookup_dir)))
+        raw_config["env_vars"].update(fragment.get("env_vars") or {})
+    return raw_config
+
+
+def config_stamp(paths):
+    stamp = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamp.append((path, None, None))
+    return stamp
+
+
+class ConfigCache:
+    version = 1
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        digest = hashlib.sha1(config_path.encode()).hexdigest()[:16]
+        self.cache_path = get_cache_dir() / f"config-{digest}.pickle"
+
+    def key(self, include_paths, relative_envs):
+        return {
+            "version": self.version,
+            "default_version": DEFAULT_VERSION,
+            "cwd": os.getcwd() if relative_envs else None,
+            "files": config_stamp([self.config_path] + include_paths),
+        }
+
+    def load(self):
+        import pickle
+
+        try:
+            with open(self.cache_path, "rb") as f:
+                cached = pickle.load(f)
+        except Exception:
+            return None
+        if cached["key"]["files"][0] != config_stamp([self.config_path])[0]:
+            return None
+        include_paths = resolve_includes(self.config_path, cached["raw_config"])
+        if cached["key"] != self.key(include_paths, cached["relative_envs"]):
+            return None
+        return Config(cached["raw_config"], path=self.config_path, preprocessed=cached["config"])
+
+    def save(self, config: Config, include_paths, relative_envs):
+        import pickle
+
+        cached = {
+            "key": self.key(include_paths, relative_envs),
+            "relative_envs": relative_envs,
+            "raw_config": config.raw_config,
+            "config": config.config,
+        }
+        write_atomic(self.cache_path, pickle.dumps(cached))
+
 
 def load_config(config_path):
-    config_path = os.path.expanduser(config_path)
+    config_path = os.path.abspath(os.path.expanduser(config_path))
     if not os.path.exists(config_path):
-        raw_config = {}
-    else:
-        with open(config_path) as f:
-            raw_config = yaml.safe_load(f) or {}
-    return Config(raw_config)
+        return Config({}, path=config_path)
+    cache = ConfigCache(config_path)
+    config = cache.load()
+    if config:
+        return config
+    raw_config = read_yaml(config_path)
+    relative_envs = any(not os.path.isabs(os.path.expanduser(k)) for k in raw_config.get("envs") or {})
+    include_paths = resolve_includes(config_path, raw_config)
+    if include_paths:
+        raw_config = merge_fragments(raw_config, include_paths)
+    config = Config(raw_config, path=config_path)
+    cache.save(config, include_paths, relative_envs)
+    return config
 
 
 def get_current_env():
     return os.environ.get("PYENV_VIRTUAL_ENV")
 
 
+def matrix_env_name(name, version):
+    return f"{name}-{version}"
+
+
+def describe_env(config, name_or_path):
+    # configured envs by name or directory, or any existing pyenv virtualenv by name
+    path = config.find_env_path(name_or_path)
+    env_conf = config.envs[path] if path else None
+    name = env_conf["name"] if env_conf else name_or_path
+    resolver = get_resolver()
+    if not (resolver.versions_dir / name).is_dir():
+        if not env_conf:
+            return None
+        return {"path": path, "config": env_conf, "prefix": None, "site_packages": None}
+    prefix = resolver.prefix(name)
+    return {"path": path, "config": env_conf, "prefix": prefix, "site_packages": resolver.site_packages(prefix)}
+
+
+def lookup_env(config, name_or_path):
+    from devenv import daemon
+
+    result = daemon.query("env", env=name_or_path, config_path=config.path)
+    if result is not None:
+        return result or None
+    return describe_env(config, name_or_path)
+
+
 def get_and_verify_env(env):
     result = env or get_current_env()
     if not result:
@@ -210,34 +745,177 @@ def get_and_verify_env(env):
     return result
 
 
+ROOT_MARKERS = [
+    'setup.py',
+    'prod-internal-requirements.txt',
+    'poetry.lock',
+    'pyproject.toml',
+    'requirements.txt',
+    '.git',
+    '.idea',
+    '.python-version',
+]
+INSTALL_METHOD_MARKERS = [
+    ("prod-internal-requirements.txt", "mono-repo"),
+    ("poetry.lock", "poetry"),
+    ("setup.py", "pip"),
+    ("requirements.txt", "requirements"),
+]
+
+
+def scan_markers(path):
+    try:
+        with os.scandir(path) as entries:
+            return sorted(entry.name for entry in entries if entry.name in ROOT_MARKERS)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class WorkspaceIndex:
+    # adding or removing a marker changes the directory mtime, so one stat validates a cached entry
+    def __init__(self, cache_path=None):
+        self.cache_path = Path(cache_path) if cache_path else get_cache_dir() / "workspace-index.json"
+        self._cache = None
+        self.dirty = False
+
+    @property
+    def cache(self) -> dict:
+        if self._cache is None:
+            self._cache = self.load_cache()
+        return self._cache
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"dirs": {}, "children": {}}
+
+    def save_cache(self):
+        if not self.dirty:
+            return
+        merged = self.load_cache()
+        for section, entries in self.cache.items():
+            merged.setdefault(section, {}).update(entries)
+        write_atomic(self.cache_path, json.dumps(merged))
+        self.dirty = False
+
+    def markers(self, path):
+        path = str(path)
+        stamp = get_mtime(path)
+        cached = self.cache["dirs"].get(path)
+        if cached and cached["stamp"] == stamp:
+            return cached["markers"]
+        markers = scan_markers(path) if stamp is not None else None
+        self.cache["dirs"][path] = {"stamp": stamp, "markers": markers}
+        self.dirty = True
+        return markers
+
+    def is_root(self, path):
+        return bool(self.markers(path))
+
+    def install_method(self, path):
+        markers = self.markers(path) or []
+        for marker, install_method in INSTALL_METHOD_MARKERS:
+            if marker in markers:
+                return install_method
+        return None
+
+    def children(self, lookup_dir):
+        lookup_dir = str(lookup_dir)
+        stamp = get_mtime(lookup_dir)
+        cached = self.cache["children"].get(lookup_dir)
+        if cached and cached["stamp"] == stamp:
+            return cached["children"]
+        with os.scandir(lookup_dir) as entries:
+            children = sorted(entry.name for entry in entries if entry.is_dir())
+        self.cache["children"][lookup_dir] = {"stamp": stamp, "children": children}
+        self.dirty = True
+        return children
+
+    def roots(self, lookup_dirs):
+        name_to_path = {}
+        for lookup_dir in lookup_dirs:
+            lookup_dir = os.path.abspath(lookup_dir)
+            for child in self.children(lookup_dir):
+                path = os.path.join(lookup_dir, child)
+                if not self.is_root(path):
+                    continue
+                name = normalize_package_name(child)
+                assert name and name not in name_to_path
+                name_to_path[name] = path
+        self.save_cache()
+        return name_to_path
+
+    def find_root(self, directory):
+        directory = Path(directory or ".").expanduser().absolute()
+        try:
+            while directory.as_posix() != '/':
+                if self.is_root(directory):
+                    return directory.as_posix()
+                directory = directory.parent
+        finally:
+            self.save_cache()
+        return None
+
+
+_workspace_index = None
+
+
+def get_workspace_index():
+    global _workspace_index
+    if _workspace_index is None:
+        _workspace_index = WorkspaceIndex()
+    return _workspace_index
+
+
 def is_env_root(path):
     path = Path(path or ".").expanduser().absolute()
-    if not path.is_dir():
-        return False
-    search_children = [
-        'setup.py',
-        'prod-internal-requirements.txt',
-        'poetry.lock',
-        'pyproject.toml',
-        'requirements.txt',
-        '.git',
-        '.idea',
-        '.python-version',
-    ]
-    for f in search_children:
-        if (path / f).exists():
-            return True
-    return False
+    return get_workspace_index().is_root(path)
 
 
 def get_env_root(directory):
-    directory = Path(directory or ".").expanduser().absolute()
-    while directory.as_posix() != '/':
-        if is_env_root(directory):
-            return directory.as_posix()
-        directory = directory.parent
-    raise RuntimeError("Can't deduce env root")
+    root = get_workspace_index().find_root(directory)
+    if root is None:
+        raise RuntimeError("Can't deduce env root")
+    return root
+
+
+def normalize_package_name(name):
+    return name.lower().replace("-", "_")
+
+
+def canonicalize_name(name):
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+def installed_distribution_versions(site_packages):
+    versions = set()
+    for entry in os.scandir(site_packages):
+        if entry.name.endswith(".dist-info"):
+            name, _, version = entry.name[:-len(".dist-info")].partition("-")
+            versions.add((canonicalize_name(name), version.lower()))
+    return versions
+
+
+def installed_distributions(site_packages):
+    names = []
+    for entry in os.scandir(site_packages):
+        if entry.name.endswith((".dist-info", ".egg-info")):
+            name = entry.name.rsplit(".", 1)[0].split("-")[0]
+        elif entry.name.endswith(".egg-link"):
+            name = entry.name[:-len(".egg-link")]
+        else:
+            continue
+        name = normalize_package_name(name)
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def get_lookup_index(lookup_dirs):
+    return get_workspace_index().roots(lookup_dirs)
 
 
 def pyenv_versions():
-    return [v.strip() for v in run("pyenv versions --bare", out=True).split("\n")]
+    return get_resolver().versions()
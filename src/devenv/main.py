@@ -1,21 +1,52 @@
+import importlib
+
 import click
-from devenv.commands import pythonpath, setup, sync, teardown, export
-from devenv.lib import load_config
+from devenv.lib import LazyConfig
+from devenv.trace import tracer
 
+commands = {
+    "pythonpath": "devenv.commands.pythonpath:pythonpath",
+    "setup": "devenv.commands.setup:setup",
+    "sync": "devenv.commands.sync:sync",
+    "teardown": "devenv.commands.teardown:teardown",
+    "export": "devenv.commands.export:export",
+    "env": "devenv.commands.env:env",
+    "wheelhouse": "devenv.commands.wheelhouse:wheelhouse",
+    "daemon": "devenv.commands.daemon:daemon",
+    "dedupe": "devenv.commands.dedupe:dedupe",
+    "watch": "devenv.commands.watch:watch",
+}
 
-@click.group()
-@click.option("--config-path", default="~/.config/devenv.yaml", envvar="DEVENV_CONFIG_PATH")
-@click.pass_context
-def cli(ctx, config_path):
-    config = load_config(config_path)
-    ctx.obj = config
 
+class LazyGroup(click.Group):
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            module_name, attr = self.lazy_commands[cmd_name].split(":")
+            self.add_command(getattr(importlib.import_module(module_name), attr), cmd_name)
+        return super().get_command(ctx, cmd_name)
 
-cli.add_command(pythonpath.pythonpath)
-cli.add_command(setup.setup)
-cli.add_command(sync.sync)
-cli.add_command(teardown.teardown)
-cli.add_command(export.export)
+    def format_commands(self, ctx, formatter):
+        # listing names only, so --help does not import every command module
+        with formatter.section("Commands"):
+            formatter.write_dl([(name, "") for name in self.list_commands(ctx)])
+
+
+@click.group(cls=LazyGroup, lazy_commands=commands)
+@click.option("--config-path", default="~/.config/devenv.yaml", envvar="DEVENV_CONFIG_PATH")
+@click.option("--trace", type=click.Path(dir_okay=False), envvar="DEVENV_TRACE")
+@click.pass_context
+def cli(ctx, config_path, trace):
+    ctx.obj = LazyConfig(config_path)
+    if trace:
+        tracer.enable(trace)
+        ctx.call_on_close(tracer.save)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+import fcntl
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import click
+
+from devenv.lib import Config, get_resolver, run, write_atomic
+
+BUILD_INFO = ".devenv-build.json"
+BASE_VERSION = re.compile(r"^\d+\.\d+(\.\d+)?([a-z]+\d*)?$")
+
+
+def platform_tag():
+    tag = f"{sys.platform}-{platform.machine()}"
+    libc, libc_version = platform.libc_ver()
+    if libc:
+        tag = f"{tag}-{libc}{libc_version}"
+    return tag
+
+
+def relocate_build(directory, old_prefix, new_prefix):
+    # the interpreter finds its prefix relative to the executable, only scripts and build metadata embed it
+    old, new = str(old_prefix).encode(), str(new_prefix).encode()
+    prefix = Path(directory)
+    candidates = [p for p in (prefix / "bin").iterdir() if p.is_file() and not p.is_symlink()]
+    candidates += list(prefix.glob("lib/python*/_sysconfigdata*.py"))
+    candidates += list(prefix.glob("lib/pkgconfig/*.pc"))
+    for path in candidates:
+        content = path.read_bytes()
+        if old not in content or (path.parent.name == "bin" and not content.startswith(b"#!")):
+            continue
+        tmp_path = path.with_name(f".{path.name}.devenv-tmp")
+        tmp_path.write_bytes(content.replace(old, new))
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def is_shared_build(directory):
+    # --enable-shared builds find libpython through an RPATH/install_name holding the build prefix
+    for path in Path(directory).glob("lib/python*/_sysconfigdata*.py"):
+        match = re.search(r"'Py_ENABLE_SHARED':\s*(\d+)", path.read_text(errors="replace"))
+        if match:
+            return match.group(1) != "0"
+    return False
+
+
+class PythonBuilds:
+    def __init__(self, config: Config, jobs=4):
+        self.path = config.python_builds
+        self.jobs = jobs
+        self.resolver = get_resolver()
+
+    def artifact_path(self, version, prefix=None):
+        # shared builds can't be relocated, so their artifacts are only reused under the same prefix
+        name = f"cpython-{version}-{platform_tag()}"
+        if prefix:
+            name = f"{name}-{hashlib.sha256(str(prefix).encode()).hexdigest()[:12]}"
+        return self.path / f"{name}.tar.gz"
+
+    def prefix(self, version):
+        return self.resolver.versions_dir / version
+
+    def is_missing(self, version):
+        return bool(BASE_VERSION.match(version)) and not (self.prefix(version) / "bin" / "python").exists()
+
+    def resolve_version(self, version):
+        # "3.12" installs as the newest known 3.12.x, which is what the prefix and artifact are named after
+        installed = self.resolver.match_version(version)
+        if installed != version or version.count(".") >= 2 or not BASE_VERSION.match(version):
+            return installed
+        try:
+            return run(f"pyenv latest --known {version}", out=True) or version
+        except subprocess.CalledProcessError:
+            # pyenv older than 2.0 has no `latest`, install() resolves after building instead
+            return version
+
+    def ensure(self, versions):
+        if not self.path:
+            return
+        missing = sorted({self.resolve_version(v) for v in versions if BASE_VERSION.match(v)})
+        missing = [v for v in missing if self.is_missing(v)]
+        if not missing:
+            return
+        click.echo(f"Installing missing Python versions: {', '.join(missing)}")
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            list(executor.map(self.install, missing))
+
+    def install(self, version):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / f".{version}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not self.is_missing(version):
+                return
+            for artifact in [self.artifact_path(version), self.artifact_path(version, self.prefix(version))]:
+                if artifact.exists():
+                    click.echo(f"Extracting Python {version} from {artifact}")
+                    if self.extract(artifact, version):
+                        return
+                    click.echo(f"{artifact} is a shared build for another prefix, not reusing it")
+            click.echo(f"Building Python {version}")
+            run(f"pyenv install --skip-existing {version}")
+            version = self.resolver.match_version(version)
+            if self.is_missing(version):
+                raise click.ClickException(f"pyenv install {version} did not produce {self.prefix(version)}")
+            prefix = self.prefix(version)
+            artifact = self.artifact_path(version, prefix if is_shared_build(prefix) else None)
+            self.archive(version, artifact)
+            click.echo(f"Archived Python {version} to {artifact}")
+
+    def archive(self, version, artifact):
+        prefix = self.prefix(version)
+        write_atomic(prefix / BUILD_INFO, json.dumps({"version": version, "prefix": str(prefix)}))
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=f".{artifact.name}.")
+        with os.fdopen(fd, "wb") as f, tarfile.open(fileobj=f, mode="w:gz") as tar:
+            # envs created under this version are not part of the build
+            tar.add(prefix, arcname=".", filter=lambda info: None if info.name.startswith("./envs") else info)
+        # the artifact dir may be shared between machines and users
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, artifact)
+
+    def extract(self, artifact, version):
+        prefix = self.prefix(version)
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.resolver.versions_dir, prefix=f".{version}."))
+        try:
+            with tarfile.open(artifact) as tar:
+                extract_kwargs = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+                tar.extractall(tmp_dir, **extract_kwargs)
+            with open(tmp_dir / BUILD_INFO) as f:
+                old_prefix = json.load(f)["prefix"]
+            if old_prefix != str(prefix):
+                if is_shared_build(tmp_dir):
+                    shutil.rmtree(tmp_dir)
+                    return False
+                relocate_build(tmp_dir, old_prefix, prefix)
+            if prefix.is_dir() and not any(prefix.iterdir()):
+                prefix.rmdir()
+            os.replace(tmp_dir, prefix)
+            return True
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
@@ -0,0 +1,117 @@
+# runs under the target env's interpreter, so only the stdlib is available here
+import json
+import os
+import py_compile
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib.util import cache_from_source
+
+SKIPPED_DIRS = {"__pycache__", "node_modules"}
+# never imported, and would otherwise keep every project root looking stale
+SKIPPED_FILES = {"setup.py"}
+CHECKED_HASH_FLAGS = 0b11
+
+
+def find_sources(directories):
+    sources = []
+    stack = list(directories)
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIPPED_DIRS and not entry.name.startswith("."):
+                    stack.append(entry.path)
+            elif entry.name.endswith(".py") and entry.name not in SKIPPED_FILES and entry.is_file():
+                sources.append(entry.path)
+    return sources
+
+
+def cache_path(source, cache_tag=None):
+    if cache_tag is None:
+        return cache_from_source(source)
+    directory, name = os.path.split(source)
+    return os.path.join(directory, "__pycache__", "{}.{}.pyc".format(name[:-3], cache_tag))
+
+
+def is_fresh(source, cache_tag=None, checked_hash=False):
+    # any pyc the import system would accept is fresh, only checked_hash dirs insist on hash based ones
+    try:
+        cache = cache_path(source, cache_tag)
+        with open(cache, "rb") as f:
+            header = f.read(16)
+        st = os.stat(source)
+    except OSError:
+        return False
+    if len(header) < 16:
+        return False
+    flags = int.from_bytes(header[4:8], "little")
+    if flags == CHECKED_HASH_FLAGS:
+        # validated against the source on import, the mtime only saves rewriting them
+        return os.stat(cache).st_mtime_ns >= st.st_mtime_ns
+    if checked_hash:
+        return False
+    if flags:
+        # unchecked hash pycs are never revalidated
+        return True
+    mtime = int.from_bytes(header[8:12], "little")
+    size = int.from_bytes(header[12:16], "little")
+    return mtime == int(st.st_mtime) & 0xFFFFFFFF and size == st.st_size & 0xFFFFFFFF
+
+
+def compile_source(source, checked_hash=False):
+    start = time.perf_counter()
+    mode = py_compile.PycInvalidationMode
+    try:
+        py_compile.compile(
+            source, doraise=True, invalidation_mode=mode.CHECKED_HASH if checked_hash else mode.TIMESTAMP
+        )
+    except (py_compile.PyCompileError, OSError, ValueError):
+        return False, 0
+    return True, time.perf_counter() - start
+
+
+def compile_hashed(source):
+    return compile_source(source, checked_hash=True)
+
+
+def stale_sources(directories, cache_tag=None, checked_hash=False):
+    sources = find_sources(directories)
+    return sources, [s for s in sources if not is_fresh(s, cache_tag, checked_hash)]
+
+
+def main(directories, checked_hash_directories=(), jobs=None):
+    # site-packages keep pip's timestamp pycs, editable source trees get checked-hash ones since
+    # checkouts and builds touch mtimes without changing the source
+    start = time.perf_counter()
+    all_sources, sources = stale_sources(directories)
+    all_hashed, hashed = stale_sources(checked_hash_directories, checked_hash=True)
+    compiled, failed, compile_time = 0, 0, 0
+    # hash based pycs need 3.7, older envs keep compiling on import
+    if (sources or hashed) and hasattr(py_compile, "PycInvalidationMode"):
+        # rewriting a valid timestamp pyc as a hash based one saves no compilation on startup
+        rewritten = {s for s in hashed if is_fresh(s)}
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(zip(sources, executor.map(compile_source, sources, chunksize=64)))
+            results += zip(hashed, executor.map(compile_hashed, hashed, chunksize=64))
+        for source, (ok, elapsed) in results:
+            compiled += ok
+            failed += not ok
+            if source not in rewritten:
+                compile_time += elapsed
+    return {
+        "compiled": compiled,
+        "skipped": len(all_sources) + len(all_hashed) - len(sources) - len(hashed),
+        "failed": failed,
+        "compile_time": compile_time,
+        "elapsed": time.perf_counter() - start,
+    }
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    split = args.index("--checked-hash") if "--checked-hash" in args else len(args)
+    sys.stdout.write(json.dumps(main(args[:split], args[split + 1:])))
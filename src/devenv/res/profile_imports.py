@@ -0,0 +1,23 @@
+# passed to the env's interpreter with -c, so only the stdlib is available here
+import json
+import runpy
+import sys
+import time
+
+output_path, target = sys.argv[1], sys.argv[2]
+sitecustomize = sys.modules.get("sitecustomize")
+start = time.perf_counter()
+try:
+    if target.endswith(".py"):
+        runpy.run_path(target, run_name="__main__")
+    else:
+        # importlib.import_module bypasses the C import path that -X importtime instruments
+        __import__(target)
+finally:
+    result = {
+        "sitecustomize": getattr(sitecustomize, "profile", None),
+        "elapsed": time.perf_counter() - start,
+        "modules": {name: getattr(module, "__file__", None) for name, module in list(sys.modules.items())},
+    }
+    with open(output_path, "w") as f:
+        json.dump(result, f)
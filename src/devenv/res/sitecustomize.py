@@ -2,17 +2,14 @@ import sys
 import os
 import site
 
+MANIFEST_VERSION = "devenv-manifest 2"
 
-# copied from site.py adding prepend support
-def addsitedir(sitedir, known_paths=None, prepend=False):
-    if known_paths is None:
-        known_paths = site._init_pathinfo()
-        reset = True
-    else:
-        reset = False
+
+# adapted from site.py, recording operations instead of applying them
+def scan_sitedir(sitedir, known_paths, operations):
     sitedir, sitedircase = site.makepath(sitedir)
     if sitedircase not in known_paths:
-        _add_to_syspath(sitedir, prepend)
+        operations.append(("path", sitedir))
         known_paths.add(sitedircase)
     try:
         names = os.listdir(sitedir)
@@ -20,18 +17,10 @@ def addsitedir(sitedir, known_paths=None, prepend=False):
         return
     names = [name for name in names if name.endswith(".pth")]
     for name in sorted(names):
-        _addpackage(sitedir, name, known_paths, prepend)
-    if reset:
-        known_paths = None
-    return known_paths
+        scan_package(sitedir, name, known_paths, operations)
 
 
-def _addpackage(sitedir, name, known_paths, prepend):
-    if known_paths is None:
-        known_paths = site._init_pathinfo()
-        reset = True
-    else:
-        reset = False
+def scan_package(sitedir, name, known_paths, operations):
     fullname = os.path.join(sitedir, name)
     try:
         f = open(fullname, "rb")
@@ -39,52 +28,261 @@ def _addpackage(sitedir, name, known_paths, prepend):
         return
     with f:
         for n, line in enumerate(f):
-            line = line.decode()
-            if line.startswith("#"):
-                continue
             try:
-                if line.startswith(("import ", "import\t")):
-                    exec(line)
-                    continue
-                line = line.rstrip()
-                directory, dircase = site.makepath(sitedir, line)
-                if dircase not in known_paths and os.path.exists(directory):
-                    _add_to_syspath(directory, prepend)
-                    known_paths.add(dircase)
-            except Exception:
+                line = line.decode()
+            except UnicodeDecodeError:
                 sys.stderr.write("Error processing line {:d} of {}:\n".format(n + 1, fullname))
-                import traceback
-
-                for record in traceback.format_exception(*sys.exc_info()):
-                    for line2 in record.splitlines():
-                        sys.stderr.write("  " + line2 + "\n")
                 sys.stderr.write("\nRemainder of file ignored\n")
                 break
-    if reset:
-        known_paths = None
-    return known_paths
+            if line.startswith("#"):
+                continue
+            if line.startswith(("import ", "import\t")):
+                operations.append(("import", sitedir, line.rstrip("\r\n")))
+                continue
+            line = line.rstrip()
+            directory, dircase = site.makepath(sitedir, line)
+            if dircase not in known_paths and os.path.exists(directory):
+                operations.append(("path", directory))
+                known_paths.add(dircase)
 
 
-# copied from site.py adding prepend support (END)
+# adapted from site.py (END)
 
 
-def _add_to_syspath(entry, prepend=False):
-    if prepend:
-        sys.path.insert(0, entry)
-    else:
+def _add_to_syspath(entry, position=None):
+    if position is None:
         sys.path.append(entry)
+    else:
+        sys.path.insert(position, entry)
 
 
-def _load():
-    external_site_packages_path = os.path.join(os.path.dirname(__file__), "external-site-packages")
+def _exec_package_line(sitedir, line):
+    # namespace package .pth lines look up `sitedir` in their caller's frame
+    try:
+        exec(line)
+    except Exception:
+        sys.stderr.write("Error processing .pth import line in {}:\n".format(sitedir))
+        import traceback
+
+        for record in traceback.format_exception(*sys.exc_info()):
+            for line2 in record.splitlines():
+                sys.stderr.write("  " + line2 + "\n")
+
+
+def top_level_names(directory):
+    import importlib.machinery
+
+    suffixes = tuple(importlib.machinery.all_suffixes())
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return []
+    names = set()
+    for entry in entries:
+        if entry.name.endswith(suffixes) and not entry.is_dir():
+            name = entry.name.partition(".")[0]
+        elif entry.is_dir():
+            name = entry.name
+        else:
+            continue
+        if name.isidentifier() and name != "__pycache__":
+            names.add(name)
+    return sorted(names)
+
+
+def scan(sitedirs, index_modules=False):
+    known_paths = set()
+    operations = []
+    for sitedir in sitedirs:
+        scan_sitedir(sitedir, known_paths, operations)
+    if index_modules:
+        for directory in [operation[1] for operation in operations if operation[0] == "path"]:
+            operations.extend(("module", name, directory) for name in top_level_names(directory))
+    return operations
+
+
+class IndexedFinder:
+    # resolves top-level imports from the external dirs with one dict lookup instead of a sys.path walk
+    def __init__(self, index):
+        self.index = index
+
+    def find_spec(self, fullname, path=None, target=None):
+        if path is not None or fullname not in self.index:
+            return None
+        import importlib.machinery
+
+        spec = importlib.machinery.PathFinder.find_spec(fullname, self.index[fullname])
+        if spec is None or spec.loader is None:
+            # namespace packages may have portions outside the index, leave them to the path finder
+            return None
+        return spec
+
+    def invalidate_caches(self):
+        pass
+
+
+def apply(operations):
+    known_paths = site._init_pathinfo()
+    index = {}
+    for operation in operations:
+        if operation[0] == "module":
+            index.setdefault(operation[1], []).append(operation[2])
+    # earlier dirs win in both modes: prepended in resolved order, or looked up in that order by the index
+    position = None if index else 0
+    for operation in operations:
+        if operation[0] == "path":
+            directory, dircase = site.makepath(operation[1])
+            if dircase not in known_paths:
+                # with an index the dirs only need to be reachable for metadata and namespace packages
+                _add_to_syspath(directory, position)
+                known_paths.add(dircase)
+                if position is not None:
+                    position += 1
+        elif operation[0] == "import":
+            _exec_package_line(operation[1], operation[2])
+    if index:
+        import importlib.machinery
+
+        # after the builtin and frozen importers, like the sys.path entries it replaces
+        path_finder = importlib.machinery.PathFinder
+        position = sys.meta_path.index(path_finder) if path_finder in sys.meta_path else len(sys.meta_path)
+        sys.meta_path.insert(position, IndexedFinder(index))
+
+
+def stamp(paths):
+    result = []
+    for path in paths:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = -1
+        result.append((path, mtime))
+    return result
+
+
+def read_external_site_packages(external_site_packages_path):
+    sitedirs = []
     if os.path.exists(external_site_packages_path):
         with open(external_site_packages_path) as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
-                addsitedir(line, None, prepend=True)
+                sitedirs.append(line)
+    return sitedirs
+
+
+def resolve(external_site_packages_path):
+    # breadth first over the linked envs' own external-site-packages, so nearer links take precedence
+    root = os.path.dirname(external_site_packages_path)
+    sitedirs = []
+    visited_files = []
+    cycles = []
+    seen = {root}
+    queue = [(external_site_packages_path, (root,))]
+    while queue:
+        next_queue = []
+        for path, chain in queue:
+            visited_files.append(path)
+            for sitedir in read_external_site_packages(path):
+                if sitedir in chain:
+                    cycles.append(chain + (sitedir,))
+                    continue
+                if sitedir in seen:
+                    continue
+                seen.add(sitedir)
+                sitedirs.append(sitedir)
+                next_queue.append((os.path.join(sitedir, "external-site-packages"), chain + (sitedir,)))
+        queue = next_queue
+    return sitedirs, visited_files, cycles
+
 
+def build_manifest(external_site_packages_path, index_modules=False):
+    sitedirs, visited_files, _ = resolve(external_site_packages_path)
+    operations = scan(sitedirs, index_modules)
+    # links added to any env down the chain change one of the visited files
+    stamped = visited_files + sitedirs
+    if index_modules:
+        # new top-level modules in editable source trees change the mtime of their directory
+        stamped += [operation[1] for operation in operations if operation[0] == "path" and operation[1] not in stamped]
+    # the mode is recorded, an indexed manifest of dirs without modules looks like a plain one otherwise
+    lines = [MANIFEST_VERSION, "index\t{:d}".format(index_modules)]
+    for path, mtime in stamp(stamped):
+        lines.append("stamp\t{}\t{}".format(mtime, path))
+    for operation in operations:
+        lines.append("\t".join(operation))
+    return "\n".join(lines) + "\n"
 
-if not os.environ.get('DEVENV_IGNORE_EXTERNAL_SITE_PACKAGES'):
+
+def read_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    if len(lines) < 2 or lines[0] != MANIFEST_VERSION or not lines[1].startswith("index\t"):
+        return None
+    index_modules = lines[1] == "index\t1"
+    stamps = []
+    operations = []
+    for line in lines[2:]:
+        kind, _, rest = line.partition("\t")
+        if kind == "stamp":
+            mtime, _, path = rest.partition("\t")
+            stamps.append((path, int(mtime)))
+        elif kind == "path":
+            operations.append(("path", rest))
+        elif kind == "import":
+            sitedir, _, package_line = rest.partition("\t")
+            operations.append(("import", sitedir, package_line))
+        elif kind == "module":
+            name, _, directory = rest.partition("\t")
+            operations.append(("module", name, directory))
+    return stamps, operations, index_modules
+
+
+def _load():
+    base_dir = os.path.dirname(__file__)
+    external_site_packages_path = os.path.join(base_dir, "external-site-packages")
+    manifest = read_manifest(os.path.join(base_dir, "external-site-packages.manifest"))
+    index_modules = False
+    if manifest:
+        stamps, operations, index_modules = manifest
+        if stamp([path for path, _ in stamps]) == stamps:
+            apply(operations)
+            return
+    apply(scan(resolve(external_site_packages_path)[0], index_modules))
+
+
+profile = None
+
+
+def _profile_load():
+    # used by `dev pythonpath profile`: times _load and counts path finder lookups per directory
+    import time
+    import importlib.machinery
+
+    global profile
+    profile = {"load_time": 0, "lookups": {}}
+    find_spec = importlib.machinery.FileFinder.find_spec
+
+    def counting_find_spec(self, fullname, target=None):
+        start = time.perf_counter()
+        try:
+            return find_spec(self, fullname, target)
+        finally:
+            entry = profile["lookups"].setdefault(self.path, [0, 0])
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+
+    importlib.machinery.FileFinder.find_spec = counting_find_spec
+    start = time.perf_counter()
     _load()
+    profile["load_time"] = time.perf_counter() - start
+
+
+if __name__ == "sitecustomize" and not os.environ.get('DEVENV_IGNORE_EXTERNAL_SITE_PACKAGES'):
+    if os.environ.get("DEVENV_PROFILE"):
+        _profile_load()
+    else:
+        _load()
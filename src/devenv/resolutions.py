@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import platform
+import shlex
+import sys
+import tempfile
+from pathlib import Path
+
+import click
+
+from devenv.lib import Env, write_atomic
+
+REQUIREMENT_FILE_FLAGS = ["-r", "--requirement", "-c", "--constraint"]
+# where pins come from, a replayed install has to look in the same places
+SOURCE_FLAGS = ["-i", "--index-url", "--extra-index-url", "-f", "--find-links", "--trusted-host"]
+SOURCE_SWITCHES = ["--pre", "--no-index"]
+INDEX_ENV_VARS = ["PIP_INDEX_URL", "PIP_EXTRA_INDEX_URL", "PIP_FIND_LINKS"]
+
+
+def flag_values(tokens, flags):
+    values = []
+    for i, token in enumerate(tokens):
+        flag, equals, value = token.partition("=")
+        if flag in flags and flag.startswith("--") and equals:
+            values.append((flag, value))
+        elif token in flags and i + 1 < len(tokens):
+            values.append((token, tokens[i + 1]))
+        elif token[:2] in flags and len(token) > 2 and not token.startswith("--"):
+            values.append((token[:2], token[2:]))
+    return values
+
+
+def included_files(tokens):
+    return [value for _, value in flag_values(tokens, REQUIREMENT_FILE_FLAGS)]
+
+
+def source_options(tokens, directory=None):
+    options = []
+    for flag, value in flag_values(tokens, SOURCE_FLAGS):
+        if flag in ["-f", "--find-links"] and directory and os.path.exists(os.path.join(directory, value)):
+            # like pip, local find-links dirs in a requirement file are relative to that file
+            value = os.path.abspath(os.path.join(directory, value))
+        options.append(f"{flag} {shlex.quote(value)}")
+    options.extend(token for token in tokens if token in SOURCE_SWITCHES)
+    return options
+
+
+def scan_requirements(args):
+    # follows -r/-c lines inside requirement files too, pip resolves those relative to the including file
+    tokens = shlex.split(args)
+    files = []
+    options = source_options(tokens)
+    queue = included_files(tokens)
+    while queue:
+        path = os.path.normpath(queue.pop(0))
+        if path in files:
+            continue
+        files.append(path)
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        directory = os.path.dirname(path)
+        for line in lines:
+            line = line.split(" #")[0].strip()
+            if line.startswith("-"):
+                line_tokens = shlex.split(line)
+                queue.extend(os.path.join(directory, p) for p in included_files(line_tokens))
+                options.extend(o for o in source_options(line_tokens, directory) if o not in options)
+    return files, options
+
+
+def referenced_files(args):
+    return scan_requirements(args)[0]
+
+
+def pinned_from_report(report):
+    # anything not coming from an index (local dirs, vcs checkouts) can't be replayed from a pin
+    pinned = []
+    for item in report["install"]:
+        download_info = item.get("download_info", {})
+        if "dir_info" in download_info or "vcs_info" in download_info:
+            return None
+        pinned.append(f"{item['metadata']['name']}=={item['metadata']['version']}")
+    return sorted(pinned, key=str.lower)
+
+
+class ResolutionCache:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def key(self, env: Env, args):
+        files, options = scan_requirements(args)
+        digest = hashlib.sha256()
+        inputs = {
+            "args": args,
+            "options": options,
+            "python_version": env.python_version,
+            "platform": f"{sys.platform}-{platform.machine()}",
+            "index": {k: os.environ.get(k) or env.config.env_vars.get(k) for k in INDEX_ENV_VARS},
+        }
+        digest.update(json.dumps(inputs, sort_keys=True).encode())
+        for path in files:
+            digest.update(path.encode())
+            try:
+                with open(path, "rb") as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            except OSError:
+                digest.update(b"missing")
+        return digest.hexdigest()[:24]
+
+    def resolve(self, env: Env, args):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report_path = os.path.join(tmp_dir, "report.json")
+            # --ignore-installed so the report holds the whole set, not just what this env lacks
+            env.pip(f"install --dry-run --ignore-installed --quiet --report {report_path} {args}")
+            with open(report_path) as f:
+                return pinned_from_report(json.load(f))
+
+    def pip_install(self, env: Env, args, requirements, install, refresh=False):
+        pinned_path = self.path / f"{self.key(env, args)}.txt"
+        if refresh or not pinned_path.exists():
+            try:
+                pinned = self.resolve(env, args)
+            except Exception:
+                # pip older than 22.2 has no --report, keep resolving on every install
+                pinned = None
+            if pinned is None:
+                install(args, requirements)
+                return
+            # the index options go into the pinned file, so a private pin is fetched from where it was found
+            lines = scan_requirements(args)[1] + pinned
+            write_atomic(pinned_path, "".join(f"{line}\n" for line in lines))
+        else:
+            click.echo(f"Using cached resolution {pinned_path.name}")
+        with open(pinned_path) as f:
+            pinned = [line for line in f.read().splitlines() if line and not line.startswith("-")]
+        install(f"--no-deps -r {shlex.quote(str(pinned_path))}", pinned)
@@ -0,0 +1,89 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import click
+
+from devenv.lib import Config, get_cache_dir, get_resolver, run
+
+READY_MARKER = ".devenv-template-ready"
+
+
+def link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def copy_tree(source, target):
+    source, target = str(source), str(target)
+    reflink_flags = ["-c"] if sys.platform == "darwin" else ["--reflink=always"]
+    result = subprocess.run(["cp", "-R", *reflink_flags, source, target], stderr=subprocess.DEVNULL)
+    if result.returncode == 0:
+        return "reflink"
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(source, target, symlinks=True, copy_function=link_or_copy)
+    return "hardlink"
+
+
+def relocate(env_dir, old_prefix, new_prefix):
+    # files are replaced rather than edited in place, which also breaks hardlinks to the template
+    old_prefix, new_prefix = str(old_prefix).encode(), str(new_prefix).encode()
+    env_dir = Path(env_dir)
+    candidates = [env_dir / "pyvenv.cfg"] + sorted((env_dir / "bin").iterdir())
+    for path in candidates:
+        if path.is_symlink() or not path.is_file():
+            continue
+        content = path.read_bytes()
+        if old_prefix not in content:
+            continue
+        tmp_path = path.with_name(f".{path.name}.devenv-tmp")
+        tmp_path.write_bytes(content.replace(old_prefix, new_prefix))
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+class EnvTemplates:
+    def __init__(self, config: Config):
+        self.config = config
+        self.root = get_cache_dir() / "templates"
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.resolver = get_resolver()
+
+    def template_path(self, version):
+        requirements = sorted(self.config.template_requirements)
+        key = hashlib.sha256(json.dumps(requirements).encode()).hexdigest()[:12]
+        return self.root / f"{version}-{key}"
+
+    def ensure_template(self, version):
+        path = self.template_path(version)
+        with open(f"{path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if (path / READY_MARKER).exists():
+                return path
+            shutil.rmtree(path, ignore_errors=True)
+            click.echo(f"Creating env template for {version} at {path}")
+            base_python = Path(self.resolver.prefix(version)) / "bin" / "python"
+            run(f"{base_python} -m venv {path}")
+            requirements = self.config.template_requirements
+            if requirements:
+                run(f"{path}/bin/pip install {' '.join(requirements)}")
+            (path / READY_MARKER).touch()
+        return path
+
+    def clone(self, version, name):
+        template = self.ensure_template(version)
+        target = self.resolver.versions_dir / version / "envs" / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        method = copy_tree(template, target)
+        (target / READY_MARKER).unlink()
+        relocate(target, template, target)
+        (self.resolver.versions_dir / name).symlink_to(target)
+        click.echo(f"Cloned {name} from {template.name} ({method})")
+        return target
@@ -0,0 +1,137 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import click
+
+HISTORY_FILE_NAME = "trace-history.json"
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.output_path = None
+        self.events = []
+        self.env = None
+        self.phase = None
+
+    def enable(self, output_path=None):
+        self.enabled = True
+        self.output_path = output_path
+
+    def reset(self):
+        self.events = []
+
+    @contextmanager
+    def scope(self, env=None, phase=None):
+        previous = self.env, self.phase
+        self.env = env or self.env
+        self.phase = phase or self.phase
+        try:
+            yield
+        finally:
+            self.env, self.phase = previous
+
+    @contextmanager
+    def command(self, command):
+        # run() waits for the process itself and leaves its rusage in the yielded dict
+        if not self.enabled:
+            yield None
+            return
+        status = 0
+        usage = {}
+        start = time.time()
+        try:
+            yield usage
+        except BaseException as e:
+            # subprocess.CalledProcessError, without importing subprocess up front
+            status = getattr(e, "returncode", -1)
+            raise
+        finally:
+            wall = time.time() - start
+            rusage = usage.get("rusage")
+            cpu = rusage.ru_utime + rusage.ru_stime if rusage else 0
+            max_rss_kb = rusage.ru_maxrss if rusage else 0
+            if sys.platform == "darwin":
+                max_rss_kb //= 1024
+            self.events.append({
+                "command": command,
+                "env": self.env,
+                "phase": self.phase,
+                "start": start,
+                "wall": wall,
+                "cpu": cpu,
+                "max_rss_kb": max_rss_kb,
+                "status": status,
+                "pid": os.getpid(),
+            })
+
+    def chrome_trace(self):
+        if not self.events:
+            return {"traceEvents": []}
+        origin = min(e["start"] for e in self.events)
+        trace_events = []
+        for e in self.events:
+            trace_events.append({
+                "name": f"{e['env'] or '-'}: {e['command']}",
+                "cat": e["phase"] or "-",
+                "ph": "X",
+                "ts": int((e["start"] - origin) * 1e6),
+                "dur": int(e["wall"] * 1e6),
+                "pid": e["pid"],
+                "tid": e["pid"],
+                "args": {k: e[k] for k in ["env", "phase", "cpu", "max_rss_kb", "status"]},
+            })
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def print_summary(self):
+        click.echo("=>   Trace summary")
+        click.echo(f"{'wall':>9} {'cpu':>9} {'rss MB':>8} {'exit':>5}  {'env':<20} {'phase':<10} command")
+        for e in sorted(self.events, key=lambda e: e["wall"], reverse=True):
+            click.echo(
+                f"{e['wall']:>8.2f}s {e['cpu']:>8.2f}s {e['max_rss_kb'] / 1024:>8.1f} {e['status']:>5}  "
+                f"{(e['env'] or '-'):<20} {(e['phase'] or '-'):<10} {e['command']}"
+            )
+
+    def save(self):
+        if not self.enabled:
+            return
+        if self.output_path:
+            with open(self.output_path, "w") as f:
+                json.dump(self.chrome_trace(), f)
+            click.echo(f"Wrote trace to {self.output_path}")
+        self.print_summary()
+        self.update_history()
+
+    def update_history(self):
+        from devenv.lib import write_atomic
+
+        history = load_history()
+        totals = {}
+        for e in self.events:
+            if not e["env"] or not e["phase"]:
+                continue
+            key = (e["env"], e["phase"])
+            totals[key] = totals.get(key, 0) + e["wall"]
+        for (env, phase), wall in totals.items():
+            history.setdefault(env, {})[phase] = wall
+        write_atomic(history_path(), json.dumps(history, indent=2))
+
+
+def history_path():
+    from devenv.lib import get_cache_dir
+
+    return get_cache_dir() / HISTORY_FILE_NAME
+
+
+def load_history():
+    try:
+        with open(history_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+tracer = Tracer()
@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.fixture
+def pyenv_root(tmp_path, monkeypatch):
+    # a fresh pyenv root, resolver, workspace index and cache dir under tmp_path
+    from devenv import lib
+
+    monkeypatch.setattr(lib, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(lib, "_resolver", lib.Resolver(tmp_path / "pyenv", tmp_path / "resolution.json"))
+    monkeypatch.setattr(lib, "_workspace_index", lib.WorkspaceIndex(tmp_path / "index.json"))
+    return tmp_path / "pyenv"
@@ -0,0 +1,8 @@
+from benchmarks.run import run_size
+
+
+def test_hot_paths_do_not_spawn_subprocesses():
+    results = {r["operation"]: r for r in run_size(10, latency_scale=0)}
+    for operation in ["load_config", "get_env_root", "pythonpath infer", "sync pythonpath"]:
+        assert results[operation]["spawns"] == 0, operation
+    assert results["sync (warm)"]["spawns"] < results["sync (cold)"]["spawns"]
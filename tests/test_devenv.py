@@ -3,3 +3,701 @@ from devenv import __version__
 
 def test_version():
     assert __version__ == "0.1.0"
+
+
+def test_sync_graph_orders_pythonpath_after_linked_envs():
+    from devenv.commands.sync import Sync
+    from devenv.lib import Config
+
+    config = Config({"envs": {"/ws/a": {"pythonpath": ["b"]}, "/ws/b": {}, "/ws/c": {"pythonpath": "infer"}}})
+    graph = Sync(config, "all", jobs=2).build_graph("-")
+    assert graph[("/ws/a", "pythonpath")] == {("/ws/a", "setup"), ("/ws/b", "setup"), ("/ws/b", "pythonpath")}
+    assert graph[("/ws/c", "pythonpath")] == {("/ws/c", "setup")}
+    assert graph[("/ws/b", "setup")] == set()
+    assert Sync(config, "all", jobs=2).build_graph("pythonpath")[("/ws/a", "pythonpath")] == {("/ws/b", "pythonpath")}
+
+    # linked both ways: one direction is kept, so the graph can still drain
+    config = Config({"envs": {"/ws/a": {"pythonpath": ["b"]}, "/ws/b": {"pythonpath": ["a"]}}})
+    graph = Sync(config, "all", jobs=2).build_graph("pythonpath")
+    assert graph == {("/ws/a", "pythonpath"): {("/ws/b", "pythonpath")}, ("/ws/b", "pythonpath"): set()}
+
+
+def test_sitecustomize_manifest_round_trip(tmp_path):
+    from devenv.res import sitecustomize
+
+    sitedir = tmp_path / "site"
+    source = tmp_path / "source"
+    sitedir.mkdir()
+    source.mkdir()
+    (sitedir / "a.pth").write_text(f"{source}\nimport os\n")
+    external_site_packages = tmp_path / "external-site-packages"
+    external_site_packages.write_text(str(sitedir))
+    manifest = tmp_path / "external-site-packages.manifest"
+    manifest.write_text(sitecustomize.build_manifest(str(external_site_packages)))
+
+    stamps, operations, index_modules = sitecustomize.read_manifest(str(manifest))
+    assert not index_modules
+    assert sitecustomize.stamp([path for path, _ in stamps]) == stamps
+    assert operations == [("path", str(sitedir)), ("path", str(source)), ("import", str(sitedir), "import os")]
+
+
+def test_load_config_merges_includes_and_caches(tmp_path, pyenv_root):
+    from devenv import lib
+
+    fragment_dir = tmp_path / "projects" / "proj"
+    fragment_dir.mkdir(parents=True)
+    (fragment_dir / "devenv.yaml").write_text("envs:\n  .: {name: proj-env}\n")
+    config_path = tmp_path / "devenv.yaml"
+    config_path.write_text("include: [projects/*/devenv.yaml]\nenvs:\n  /ws/a: {}\n")
+
+    config = lib.load_config(str(config_path))
+    assert config.find_env("proj-env") is config.envs[str(fragment_dir)]
+    assert config.find_env_path("a") == "/ws/a"
+    assert list((tmp_path / "cache").glob("config-*.pickle"))
+
+    cached = lib.load_config(str(config_path))
+    assert cached.envs == config.envs
+    (fragment_dir / "devenv.yaml").write_text("envs:\n  .: {name: renamed}\n")
+    assert lib.load_config(str(config_path)).find_env("renamed")
+
+
+def test_jdk_table_xml_batches_edits(tmp_path):
+    from devenv.lib import JDKTableXML
+
+    path = tmp_path / "jdk.table.xml"
+    path.write_text('<application>\n  <component name="ProjectJdkTable" />\n</application>\n')
+    jdk_table_xml = JDKTableXML("PyCharm")
+    jdk_table_xml.path = str(path)
+    for name in ["a", "b", "c"]:
+        jdk_table_xml.add_entry(f'<jdk version="2">\n  <name value="{name}" />\n</jdk>', name)
+    jdk_table_xml.remove_entry("b")
+    jdk_table_xml.save()
+
+    assert sorted(JDKTableXML.build_index(path.read_text())) == ["a", "c"]
+    assert path.read_text().startswith('<application>\n  <component name="ProjectJdkTable">\n    <jdk version="2">')
+
+
+def test_workspace_index_refreshes_by_directory_mtime(tmp_path):
+    import os
+    from devenv.lib import WorkspaceIndex
+
+    workspace = tmp_path / "ws"
+    (workspace / "a" / "pkg").mkdir(parents=True)
+    (workspace / "a" / "poetry.lock").touch()
+    (workspace / "b").mkdir()
+    index = WorkspaceIndex(tmp_path / "index.json")
+    assert index.roots([str(workspace)]) == {"a": str(workspace / "a")}
+    assert index.find_root(workspace / "a" / "pkg") == str(workspace / "a")
+    assert index.install_method(workspace / "a") == "poetry"
+
+    (workspace / "b" / "setup.py").touch()
+    os.utime(workspace / "b", ns=(0, 0))
+    index = WorkspaceIndex(tmp_path / "index.json")
+    assert index.roots([str(workspace)]) == {"a": str(workspace / "a"), "b": str(workspace / "b")}
+    assert index.install_method(workspace / "b") == "pip"
+
+
+def test_sitecustomize_indexed_finder(tmp_path):
+    import os
+    import subprocess
+    import sys
+    from devenv.res import sitecustomize
+
+    source = tmp_path / "source"
+    (source / "linked_pkg").mkdir(parents=True)
+    (source / "linked_pkg" / "__init__.py").write_text("VALUE = 1\n")
+    (source / "linked_mod.py").write_text("VALUE = 2\n")
+    external_site_packages = tmp_path / "external-site-packages"
+    external_site_packages.write_text(str(source))
+    manifest = tmp_path / "external-site-packages.manifest"
+    manifest.write_text(sitecustomize.build_manifest(str(external_site_packages), index_modules=True))
+
+    _, operations, _ = sitecustomize.read_manifest(str(manifest))
+    assert ("module", "linked_pkg", str(source)) in operations
+    assert ("module", "linked_mod", str(source)) in operations
+    script = (
+        "import sys; from devenv.res import sitecustomize; "
+        f"sitecustomize.apply(sitecustomize.read_manifest({str(manifest)!r})[1]); "
+        "import linked_pkg, linked_mod; "
+        f"print(linked_pkg.VALUE, linked_mod.VALUE, sys.path[-1] == {str(source)!r})"
+    )
+    result = subprocess.run([sys.executable, "-c", script], stdout=subprocess.PIPE, check=True, env={
+        "PYTHONPATH": os.pathsep.join(sys.path),
+    })
+    assert result.stdout.split() == [b"1", b"2", b"True"]
+
+
+def test_sitecustomize_linked_dirs_take_precedence_in_resolved_order(tmp_path):
+    import os
+    import subprocess
+    import sys
+    from devenv.res import sitecustomize
+
+    b, c = tmp_path / "b", tmp_path / "c"
+    for sitedir in [b, c]:
+        sitedir.mkdir()
+        (sitedir / "shared.py").write_text(f"NAME = {sitedir.name!r}\n")
+    external_site_packages = tmp_path / "external-site-packages"
+    external_site_packages.write_text(f"{b}\n{c}")
+    for index_modules in [False, True]:
+        manifest = tmp_path / "external-site-packages.manifest"
+        manifest.write_text(sitecustomize.build_manifest(str(external_site_packages), index_modules))
+        script = (
+            "from devenv.res import sitecustomize; "
+            f"sitecustomize.apply(sitecustomize.read_manifest({str(manifest)!r})[1]); "
+            "import shared; print(shared.NAME)"
+        )
+        result = subprocess.run([sys.executable, "-c", script], stdout=subprocess.PIPE, check=True, env={
+            "PYTHONPATH": os.pathsep.join(sys.path),
+        })
+        assert result.stdout.split() == [b"b"]
+
+
+def test_pythonpath_resolves_links_transitively(tmp_path):
+    from devenv.commands.pythonpath import find_shadowed
+    from devenv.res import sitecustomize
+
+    a, b, c, d = (tmp_path / name for name in "abcd")
+    for sitedir in [a, b, c, d]:
+        sitedir.mkdir()
+    (a / "external-site-packages").write_text(f"{b}\n{d}")
+    (b / "external-site-packages").write_text(f"{c}\n{a}")
+    (c / "external-site-packages").write_text(str(d))
+    sitedirs, _, cycles = sitecustomize.resolve(str(a / "external-site-packages"))
+    assert sitedirs == [str(b), str(d), str(c)]
+    assert cycles == [(str(a), str(b), str(a))]
+
+    (b / "shared.py").touch()
+    (c / "shared").mkdir()
+    (c / "shared" / "__init__.py").touch()
+    (d / "only_d.py").touch()
+    shadowed, redundant = find_shadowed(sitecustomize.scan(sitedirs, index_modules=True))
+    assert shadowed == {"shared": (str(b), [str(c)])}
+    assert redundant == [str(c)]
+
+
+def test_bulk_teardown_finds_orphans_and_stale_python_versions(tmp_path, pyenv_root):
+    from devenv import lib
+    from devenv.commands.teardown import BulkTearDown
+
+    envs = pyenv_root / "versions" / "3.8.2" / "envs"
+    for name in ["kept", "kept-3.8", "orphan"]:
+        (envs / name / "lib").mkdir(parents=True)
+        (envs / name / "lib" / "module.py").write_text("x" * 10000)
+        (pyenv_root / "versions" / name).symlink_to(envs / name)
+    workspace = tmp_path / "ws"
+    for name in ["kept", "stale", "matrix"]:
+        (workspace / name / ".idea").mkdir(parents=True)
+    (workspace / "stale" / ".python-version").write_text("orphan\n")
+    (workspace / "matrix" / ".python-version").write_text("kept\norphan\n")
+    config = lib.Config({
+        "envs": {str(workspace / "kept"): {"versions": ["3.8", "3.9"]}},
+        "pythonpath_lookup_dirs": [str(workspace)],
+    })
+
+    bulk = BulkTearDown(config, idea_prefix="NoSuchIDE")
+    candidates = bulk.candidates()
+    assert [(c["name"], c["directory"]) for c in candidates] == [("orphan", None)]
+    bulk.measure(candidates)
+    assert candidates[0]["size"] >= 10000 and candidates[0]["shared"] == 0
+    bulk.clean_up(candidates)
+    assert not (workspace / "stale" / ".python-version").exists()
+    assert (workspace / "matrix" / ".python-version").read_text() == "kept\n"
+    assert (workspace / "stale" / ".idea").is_dir() and (workspace / "matrix" / ".idea").is_dir()
+
+
+def test_file_store_links_identical_files(tmp_path, monkeypatch):
+    import os
+    from devenv.commands import dedupe
+    from devenv.commands.dedupe import FileStore
+
+    walked = []
+    iter_files = dedupe.iter_files
+    monkeypatch.setattr(dedupe, "iter_files", lambda path: walked.append(path) or iter_files(path))
+
+    for env in ["a", "b"]:
+        (tmp_path / env / "pkg").mkdir(parents=True)
+        (tmp_path / env / "pkg" / "module.py").write_text("shared = True\n")
+        (tmp_path / env / "pkg" / f"only_{env}.py").write_text(env)
+        (tmp_path / env / "external-site-packages").write_text("/somewhere")
+    store = FileStore(tmp_path / "store")
+    store.dedupe(str(tmp_path / "a"))
+    store.dedupe(str(tmp_path / "b"))
+
+    assert (store.added, store.linked) == (3, 1)
+    assert os.path.samefile(tmp_path / "a" / "pkg" / "module.py", tmp_path / "b" / "pkg" / "module.py")
+    assert not os.stat(tmp_path / "b" / "pkg" / "module.py").st_mode & 0o222
+    assert os.stat(tmp_path / "b" / "external-site-packages").st_nlink == 1
+    assert walked.count(str(tmp_path / "store")) == 1
+
+    (tmp_path / "a" / "pkg" / "only_a.py").unlink()
+    assert store.prune() > 0
+
+
+def test_pythonpath_reconcile_is_a_no_op_when_up_to_date(tmp_path, pyenv_root):
+    from devenv import lib
+    from devenv.commands.pythonpath import PythonPath
+
+    versions = pyenv_root / "versions"
+    for name in ["a", "b"]:
+        (versions / name / "lib" / "python3.8" / "site-packages").mkdir(parents=True)
+        (versions / name / "pyvenv.cfg").write_text("version = 3.8.2\n")
+    config = lib.Config({"envs": {}})
+    site_packages = str(versions / "b" / "lib" / "python3.8" / "site-packages")
+
+    p = PythonPath(config, "a")
+    assert p.reconcile(["b"], dry_run=True) == [f"+ {site_packages}", "+ sitecustomize.py symlink"]
+    assert not (versions / "a" / "lib" / "python3.8" / "site-packages" / "external-site-packages").exists()
+    assert len(p.reconcile(["b"])) == 2
+    assert PythonPath(config, "a").reconcile(["b"]) == []
+    assert PythonPath(config, "a").reconcile([]) == [f"- {site_packages}"]
+
+    # an indexed manifest of dirs with no top-level modules is still up to date
+    config = lib.Config({"envs": {}, "use_import_index": True})
+    assert PythonPath(config, "a").reconcile(["b"])
+    assert PythonPath(config, "a").reconcile(["b"]) == []
+
+
+def test_watch_schedules_env_on_install_input_change(tmp_path):
+    import time
+    from devenv.commands.watch import Watch
+    from devenv.lib import Config
+
+    project = tmp_path / "project"
+    project.mkdir()
+    w = Watch(Config({"envs": {str(project): {}}}, path=str(tmp_path / "devenv.yaml")))
+    w.watch_all()
+    (project / "notes.txt").write_text("x")
+    for i in range(3):
+        (project / "requirements.txt").write_text(str(i))
+    deadline = time.monotonic() + 2
+    while not w.pending and time.monotonic() < deadline:
+        w.handle(w.inotify.read(0.1))
+    assert w.pending == {str(project): {"setup", "pythonpath"}}
+
+
+def test_watch_submits_pending_steps_in_order(tmp_path, monkeypatch):
+    from concurrent.futures import Future
+    from devenv.commands import watch
+    from devenv.commands.sync import StepResult
+    from devenv.lib import Config
+
+    class ImmediateExecutor:
+        def submit(self, fn, *args):
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+    ran = []
+
+    def run_step(sync, step, path, env_conf):
+        ran.append((step, path))
+        return StepResult("ok", "", 0.1, None, None, [])
+
+    monkeypatch.setattr(watch, "_run_step", run_step)
+    project = tmp_path / "project"
+    project.mkdir()
+    w = watch.Watch(Config({"envs": {str(project): {}}}, path=str(tmp_path / "devenv.yaml")))
+    try:
+        w.schedule(str(project), "pythonpath", "export")
+        w.schedule(str(project), "setup")
+        w.submit(ImmediateExecutor())
+        assert w.pending == {}
+        assert ran == [("setup", str(project)), ("pythonpath", str(project)), ("export", str(project))]
+        w.collect(list(w.running))
+        assert w.running == {}
+    finally:
+        w.inotify.close()
+
+
+def test_precompile_keeps_valid_pycs_and_hashes_source_trees(tmp_path):
+    import py_compile
+    import sys
+    from devenv.res import precompile
+
+    tree, site_packages = tmp_path / "tree", tmp_path / "site-packages"
+    (tree / "pkg").mkdir(parents=True)
+    (tree / "pkg" / "module.py").write_text("x = 1\n")
+    (tree / "setup.py").write_text("")
+    site_packages.mkdir()
+    (site_packages / "installed.py").write_text("y = 1\n")
+    (site_packages / "missing.py").write_text("z = 1\n")
+    # what pip leaves behind: valid timestamp pycs
+    py_compile.compile(str(site_packages / "installed.py"))
+    py_compile.compile(str(tree / "pkg" / "module.py"))
+
+    summary = precompile.main([str(site_packages)], [str(tree)], jobs=1)
+    assert summary["compiled"] == 2 and summary["skipped"] == 1
+    with open(precompile.cache_path(str(site_packages / "missing.py")), "rb") as f:
+        assert f.read(8)[4:] == b"\0\0\0\0"
+    sources, stale = precompile.stale_sources([str(tree)], sys.implementation.cache_tag, checked_hash=True)
+    assert sources == [str(tree / "pkg" / "module.py")] and stale == []
+    assert precompile.main([str(site_packages)], [str(tree)], jobs=1)["skipped"] == 3
+
+
+def test_pythonpath_profile_attributes_import_time_to_directories():
+    from devenv.commands.pythonpath import parse_importtime, attribute_import_times
+
+    stderr = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       100 |        100 |   json",
+        "import time:      2000 |       2100 | linked",
+        "unrelated output",
+    ])
+    run_info = {
+        "elapsed": 0.01,
+        "modules": {"json": "/usr/lib/python3.8/json/__init__.py", "linked": "/ws/linked/linked/__init__.py"},
+        "sitecustomize": {"load_time": 0.001, "lookups": {"/ws/linked": [3, 0.0005]}},
+    }
+    report = attribute_import_times(parse_importtime(stderr), run_info, ["/ws/linked"])
+    assert report["sitecustomize_time"] == 0.001
+    assert report["directories"][0] == {
+        "directory": "/ws/linked", "modules": 1, "import_time": 0.002, "lookups": 3, "lookup_time": 0.0005,
+    }
+    assert [m["module"] for m in report["slowest_modules"]] == ["linked", "json"]
+
+
+def test_match_version_picks_newest_installed_patch_release(tmp_path):
+    from devenv.lib import Resolver
+
+    for version in ["3.8.2", "3.8.10", "3.9.1", "3.8.10/envs/x"]:
+        (tmp_path / "versions" / version).mkdir(parents=True)
+    resolver = Resolver(tmp_path, tmp_path / "resolution.json")
+    assert resolver.match_version("3.8") == "3.8.10"
+    assert resolver.match_version("3.9.1") == "3.9.1"
+    assert resolver.match_version("3.12") == "3.12"
+
+
+def test_python_builds_round_trip_through_artifact(tmp_path, pyenv_root, monkeypatch):
+    import os
+    from devenv import lib
+    from devenv.pythons import PythonBuilds
+
+    builds = PythonBuilds(lib.Config({"python_builds": str(tmp_path / "builds")}))
+    prefix = builds.prefix("3.8.2")
+    (prefix / "bin").mkdir(parents=True)
+    (prefix / "envs" / "some-env").mkdir(parents=True)
+    (prefix / "bin" / "python").write_bytes(b"\x7fELF" + str(prefix).encode())
+    (prefix / "bin" / "pip").write_text(f"#!{prefix}/bin/python\n")
+    builds.path.mkdir()
+    builds.archive("3.8.2", builds.artifact_path("3.8.2"))
+
+    # extracted on another machine, under a different pyenv root
+    monkeypatch.setattr(lib, "_resolver", lib.Resolver(tmp_path / "other-pyenv", tmp_path / "resolution.json"))
+    builds = PythonBuilds(lib.Config({"python_builds": str(tmp_path / "builds")}))
+    builds.resolver.versions_dir.mkdir(parents=True)
+    assert builds.is_missing("3.8.2") and not builds.is_missing("system")
+    builds.ensure(["3.8.2"])
+    new_prefix = builds.prefix("3.8.2")
+    assert (new_prefix / "bin" / "pip").read_text() == f"#!{new_prefix}/bin/python\n"
+    assert (new_prefix / "bin" / "python").read_bytes() == b"\x7fELF" + str(prefix).encode()
+    assert not os.path.exists(new_prefix / "envs")
+
+
+def test_resolution_cache_replays_pinned_set(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    from devenv.lib import Config
+    from devenv.resolutions import ResolutionCache, pinned_from_report, referenced_files
+
+    report = {"install": [
+        {"metadata": {"name": "six", "version": "1.16.0"}, "download_info": {"archive_info": {}}},
+        {"metadata": {"name": "Attrs", "version": "23.1.0"}, "download_info": {"archive_info": {}}},
+    ]}
+    assert pinned_from_report(report) == ["Attrs==23.1.0", "six==1.16.0"]
+    report["install"].append({"metadata": {"name": "pkg", "version": "0.1"}, "download_info": {"dir_info": {}}})
+    assert pinned_from_report(report) is None
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "requirements.txt").write_text("six\nattrs\n")
+    env = SimpleNamespace(python_version="3.8.2", config=Config({}))
+    cache = ResolutionCache(tmp_path / "resolutions")
+    resolved = []
+    monkeypatch.setattr(cache, "resolve", lambda env, args: resolved.append(args) or ["attrs==23.1.0", "six==1.16.0"])
+    installs = []
+    install = lambda args, requirements=(): installs.append((args, list(requirements)))
+
+    cache.pip_install(env, "-r requirements.txt", [], install)
+    cache.pip_install(env, "-r requirements.txt", [], install)
+    assert len(resolved) == 1
+    assert installs[0] == installs[1]
+    assert installs[0][0].startswith("--no-deps -r ") and installs[0][1] == ["attrs==23.1.0", "six==1.16.0"]
+
+    (tmp_path / "requirements.txt").write_text("six\n-r base/requirements.txt\n")
+    (tmp_path / "base").mkdir()
+    (tmp_path / "base" / "requirements.txt").write_text("attrs\n-c constraints.txt\n")
+    (tmp_path / "base" / "constraints.txt").write_text("attrs<24\n")
+    cache.pip_install(env, "-r requirements.txt", [], install)
+    assert len(resolved) == 2
+    assert referenced_files("-r requirements.txt") == [
+        "requirements.txt", "base/requirements.txt", "base/constraints.txt",
+    ]
+    (tmp_path / "base" / "constraints.txt").write_text("attrs<23\n")
+    cache.pip_install(env, "-r requirements.txt", [], install)
+    assert len(resolved) == 3
+
+    (tmp_path / "base" / "wheels").mkdir()
+    (tmp_path / "base" / "requirements.txt").write_text("--extra-index-url https://pypi.internal/simple\n-f wheels\nattrs\n")
+    installs.clear()
+    cache.pip_install(env, "--pre -r requirements.txt", [], install)
+    cache.pip_install(env, "--pre -r requirements.txt", [], install)
+    assert len(resolved) == 4 and installs[0] == installs[1]
+    pinned_path = installs[0][0].split()[-1]
+    with open(pinned_path) as f:
+        assert f.read().splitlines() == [
+            "--pre",
+            "--extra-index-url https://pypi.internal/simple",
+            f"-f {tmp_path / 'base' / 'wheels'}",
+            "attrs==23.1.0",
+            "six==1.16.0",
+        ]
+    assert installs[0][1] == ["attrs==23.1.0", "six==1.16.0"]
+
+
+def test_python_builds_resolve_partial_versions(tmp_path, pyenv_root, monkeypatch):
+    from devenv import lib, pythons
+
+    builds = pythons.PythonBuilds(lib.Config({"python_builds": str(tmp_path / "builds")}))
+    builds.resolver.versions_dir.mkdir(parents=True)
+    commands = []
+
+    def fake_run(command, out=False):
+        commands.append(command)
+        if command == "pyenv latest --known 3.12":
+            return "3.12.4"
+        (builds.prefix("3.12.4") / "bin").mkdir(parents=True)
+        (builds.prefix("3.12.4") / "bin" / "python").touch()
+
+    monkeypatch.setattr(pythons, "run", fake_run)
+    builds.ensure(["3.12"])
+    assert commands == ["pyenv latest --known 3.12", "pyenv install --skip-existing 3.12.4"]
+    assert builds.artifact_path("3.12.4").exists()
+    assert not builds.prefix("3.12").exists()
+
+    builds.ensure(["3.12"])
+    assert len(commands) == 2
+    assert builds.resolver.match_version("3.12") == "3.12.4"
+
+
+def test_wheelhouse_checks_tags_and_falls_back_to_the_index(tmp_path):
+    import subprocess
+    from types import SimpleNamespace
+    from devenv.commands.wheelhouse import Wheelhouse
+
+    wheelhouse = Wheelhouse(tmp_path / "wheelhouse")
+    (wheelhouse.path / "fast-1.0-cp38-cp38-manylinux1_x86_64.whl").touch()
+    (wheelhouse.path / "pure-2.0-py2.py3-none-any.whl").touch()
+    commands = []
+
+    def pip(command):
+        commands.append(command.split()[0] + (" --no-index" if "--no-index" in command else ""))
+        if "--no-index" in command and fail_no_index:
+            raise subprocess.CalledProcessError(1, command)
+
+    fail_no_index = False
+    tags = {"cp311-cp311-manylinux1_x86_64", "py3-none-any"}
+    env = SimpleNamespace(prefix=tmp_path / "py311", pip=pip, python=lambda command, out: " ".join(tags))
+    assert wheelhouse.missing(["fast==1.0", "pure==2.0"], tags) == ["fast==1.0"]
+    wheelhouse.pip_install(env, "fast==1.0 pure==2.0", ["fast==1.0", "pure==2.0"])
+    assert commands == ["wheel", "install --no-index"]
+
+    commands.clear()
+    fail_no_index = True
+    wheelhouse.pip_install(env, "pure==2.0", ["pure==2.0"])
+    assert commands == ["install --no-index", "install"]
+
+
+def test_quiet_export_still_reports_conflicts(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    from devenv.commands import export
+
+    (tmp_path / "env" / "bin").mkdir(parents=True)
+    (tmp_path / "exported").mkdir()
+    for name in ["tool", "other"]:
+        (tmp_path / "env" / "bin" / name).touch()
+    (tmp_path / "exported" / "tool").symlink_to(tmp_path / "env" / "bin" / "tool")
+    (tmp_path / "exported" / "other").touch()
+    monkeypatch.setattr(export, "get_and_verify_env", lambda name: name)
+    exp = export.Export(config=None, source_env="env", export_dir=tmp_path / "exported")
+    exp._env = SimpleNamespace(prefix=tmp_path / "env")
+    messages = []
+    monkeypatch.setattr(export.click, "echo", messages.append)
+
+    assert exp.export("tool", quiet=True) is None
+    assert exp.export("other", quiet=True) is None
+    assert len(messages) == 1 and "not symlinked" in messages[0]
+
+
+def test_trace_records_per_command_peak_rss(monkeypatch):
+    import subprocess
+    import sys
+    import pytest
+    from devenv import lib
+    from devenv.trace import Tracer
+
+    tracer = Tracer()
+    tracer.enable()
+    monkeypatch.setattr(lib, "tracer", tracer)
+    lib.run(f"{sys.executable} -c 'b = bytearray(200 * 1024 * 1024); b[::4096] = b\"x\" * len(b[::4096])'", out=True)
+    assert lib.run("echo small", out=True) == "small"
+    with pytest.raises(subprocess.CalledProcessError):
+        lib.run("exit 3", out=True)
+    big, small, failed = tracer.events
+    assert big["max_rss_kb"] > 150 * 1024
+    assert 0 < small["max_rss_kb"] < 50 * 1024
+    assert failed["status"] == 3
+
+
+def test_daemon_answers_env_lookup_and_client_falls_back(tmp_path, pyenv_root, monkeypatch):
+    import json
+    import threading
+    from click.testing import CliRunner
+    from devenv import daemon, lib
+    from devenv.commands.daemon import DaemonServer
+    from devenv.main import cli
+
+    env_prefix = pyenv_root / "versions" / "3.8.2" / "envs" / "project"
+    (env_prefix / "lib" / "python3.8" / "site-packages").mkdir(parents=True)
+    (env_prefix / "pyvenv.cfg").write_text("version = 3.8.2\n")
+    (pyenv_root / "versions" / "project").symlink_to(env_prefix)
+    config_path = tmp_path / "devenv.yaml"
+    config_path.write_text(f"include: [fragments/*.yaml]\nenvs:\n  {tmp_path / 'project'}: {{}}\n")
+    (tmp_path / "fragments").mkdir()
+    fragment = tmp_path / "fragments" / "tools.yaml"
+    fragment.write_text("envs:\n  ../tools: {}\n")
+    monkeypatch.setattr(daemon, "SOCKET_PATH", str(tmp_path / "daemon.sock"))
+    monkeypatch.delenv("DEVENV_NO_DAEMON", raising=False)
+    config = lib.load_config(str(config_path))
+    expected = {
+        "path": str(tmp_path / "project"),
+        "config": config.envs[str(tmp_path / "project")],
+        "prefix": str(pyenv_root / "versions" / "project"),
+        "site_packages": str(pyenv_root / "versions" / "project" / "lib" / "python3.8" / "site-packages"),
+    }
+    assert daemon.query("ping") is None
+    assert lib.lookup_env(config, "project") == expected
+
+    server = DaemonServer(str(config_path), daemon.get_socket_path())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        assert daemon.query("env", env="project", config_path=str(config_path)) == expected
+        assert daemon.query("env", env=str(tmp_path / "project"), config_path=str(config_path)) == expected
+        assert daemon.query("env", env="unknown", config_path=str(config_path)) == {}
+        assert lib.lookup_env(config, "unknown") is None
+        assert daemon.query("env", env="project", config_path=str(tmp_path / "other.yaml")) is None
+        assert daemon.query("env", env="tools", config_path=str(config_path))["config"]["export"] == []
+        fragment.write_text("envs:\n  ../tools: {export: [tool]}\n")
+        assert daemon.query("env", env="tools", config_path=str(config_path))["config"]["export"] == ["tool"]
+        result = CliRunner().invoke(cli, ["--config-path", str(config_path), "env", "project"])
+        assert result.exit_code == 0 and json.loads(result.output) == expected
+    finally:
+        daemon.query("shutdown")
+        thread.join()
+        server.server_close()
+    assert daemon.query("env", env="project") is None
+    assert lib.lookup_env(config, "project") == expected
+    result = CliRunner().invoke(cli, ["--config-path", str(config_path), "env", "unknown"])
+    assert result.exit_code == 1 and "neither" in result.output
+
+
+def test_setup_skips_install_until_inputs_change(tmp_path, pyenv_root, monkeypatch):
+    from types import SimpleNamespace
+    from devenv import lib
+    from devenv.commands.setup import Setup
+
+    project, prefix = tmp_path / "project", tmp_path / "prefix"
+    project.mkdir()
+    prefix.mkdir()
+    (project / "requirements.txt").write_text("six\n")
+    monkeypatch.chdir(tmp_path)
+    config = lib.Config({"precompile": False})
+    installs = []
+
+    def install(force=False):
+        setup = Setup(None, "3.8.2", True, "requirements", config, str(project), force=force)
+        setup.env = SimpleNamespace(python_version="3.8.2")
+        setup.prefix = str(prefix)
+        setup.install_requirements = lambda: installs.append(setup.name)
+        setup.install()
+        return setup
+
+    assert install().install_time is not None
+    assert install().install_skipped and len(installs) == 1
+    assert not install(force=True).install_skipped and len(installs) == 2
+    (project / "requirements.txt").write_text("six\nattrs\n")
+    assert not install().install_skipped and len(installs) == 3
+    assert install().install_skipped and len(installs) == 3
+    (project / "requirements").mkdir()
+    (project / "requirements" / "base.txt").write_text("attrs\n")
+    (project / "requirements.txt").write_text("six\n-r requirements/base.txt\n")
+    assert not install().install_skipped and len(installs) == 4
+    (project / "requirements" / "base.txt").write_text("attrs<23\n")
+    assert not install().install_skipped and len(installs) == 5
+    (project / "setup.cfg").write_text("[options]\ninstall_requires = six\n")
+    assert not install().install_skipped and len(installs) == 6
+    assert install().install_skipped and len(installs) == 6
+
+
+def test_env_templates_clone_relocates_without_touching_the_template(tmp_path, pyenv_root, monkeypatch):
+    import os
+    from types import SimpleNamespace
+    from devenv import lib, templates
+
+    # no reflink support, so the tree is hardlinked
+    monkeypatch.setattr(templates.subprocess, "run", lambda *args, **kwargs: SimpleNamespace(returncode=1))
+    env_templates = templates.EnvTemplates(lib.Config({}))
+    template = env_templates.template_path("3.8.2")
+    (template / "bin").mkdir(parents=True)
+    (template / "lib" / "python3.8" / "site-packages").mkdir(parents=True)
+    (template / templates.READY_MARKER).touch()
+    (template / "pyvenv.cfg").write_text(f"home = /usr/bin\ncommand = /usr/bin/python -m venv {template}\n")
+    (template / "bin" / "pip").write_text(f"#!{template}/bin/python\n")
+    (template / "bin" / "python").symlink_to("/usr/bin/python3")
+    (template / "lib" / "python3.8" / "site-packages" / "module.py").write_text("x = 1\n")
+
+    target = env_templates.clone("3.8.2", "project")
+    assert target == pyenv_root / "versions" / "3.8.2" / "envs" / "project"
+    assert os.readlink(pyenv_root / "versions" / "project") == str(target)
+    assert (target / "bin" / "pip").read_text() == f"#!{target}/bin/python\n"
+    assert str(target) in (target / "pyvenv.cfg").read_text()
+    assert os.readlink(target / "bin" / "python") == "/usr/bin/python3"
+    assert not (target / templates.READY_MARKER).exists()
+
+    assert (template / "bin" / "pip").read_text() == f"#!{template}/bin/python\n"
+    assert str(template) in (template / "pyvenv.cfg").read_text()
+    assert (template / templates.READY_MARKER).exists()
+    module = "lib/python3.8/site-packages/module.py"
+    assert os.stat(target / module).st_ino == os.stat(template / module).st_ino
+    assert os.stat(target / "bin" / "pip").st_ino != os.stat(template / "bin" / "pip").st_ino
+
+
+def test_python_builds_only_reuse_shared_builds_under_the_same_prefix(tmp_path, pyenv_root, monkeypatch):
+    from devenv import lib, pythons
+
+    def make_build(prefix):
+        (prefix / "bin").mkdir(parents=True)
+        (prefix / "bin" / "python").touch()
+        (prefix / "lib" / "python3.8").mkdir(parents=True)
+        (prefix / "lib" / "python3.8" / "_sysconfigdata__linux_x86_64-linux-gnu.py").write_text(
+            f"build_time_vars = {{'Py_ENABLE_SHARED': 1, 'prefix': '{prefix}'}}\n"
+        )
+
+    builds = pythons.PythonBuilds(lib.Config({"python_builds": str(tmp_path / "builds")}))
+    make_build(builds.prefix("3.8.2"))
+    assert pythons.is_shared_build(builds.prefix("3.8.2"))
+    builds.path.mkdir()
+    artifact = builds.artifact_path("3.8.2", builds.prefix("3.8.2"))
+    builds.archive("3.8.2", artifact)
+    assert not builds.artifact_path("3.8.2").exists()
+
+    monkeypatch.setattr(lib, "_resolver", lib.Resolver(tmp_path / "other-pyenv", tmp_path / "resolution.json"))
+    builds = pythons.PythonBuilds(lib.Config({"python_builds": str(tmp_path / "builds")}))
+    builds.resolver.versions_dir.mkdir(parents=True)
+    # an artifact from before shared builds were keyed by prefix
+    artifact.rename(builds.artifact_path("3.8.2"))
+    commands = []
+    monkeypatch.setattr(pythons, "run", lambda command: commands.append(command) or make_build(builds.prefix("3.8.2")))
+    builds.ensure(["3.8.2"])
+    assert commands == ["pyenv install --skip-existing 3.8.2"]
+    assert builds.artifact_path("3.8.2", builds.prefix("3.8.2")).exists()
+    assert not list(builds.resolver.versions_dir.glob(".3.8.2.*"))
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import time
+
+STARTUP_BUDGET = float(os.environ.get("DEVENV_STARTUP_BUDGET", "1.0"))
+HEAVY_MODULES = ["yaml", "xml.dom.minidom", "subprocess"]
+
+
+def run_cli(args, env=None):
+    final_env = os.environ.copy()
+    final_env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    final_env["DEVENV_NO_DAEMON"] = "1"
+    final_env.update(env or {})
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "from devenv.main import cli; cli(prog_name='dev')", *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=final_env,
+    )
+    elapsed = time.perf_counter() - start
+    imported = set()
+    for line in result.stderr.decode().splitlines():
+        if line.startswith("import time:") and "|" in line:
+            imported.add(line.rsplit("|", 1)[1].strip())
+    return result, elapsed, imported
+
+
+def test_help_startup():
+    result, elapsed, imported = run_cli(["--help"])
+    assert result.returncode == 0
+    assert b"pythonpath" in result.stdout
+    assert not imported & set(HEAVY_MODULES)
+    assert not any(m.startswith("devenv.commands.") for m in imported)
+    assert elapsed < STARTUP_BUDGET
+
+
+def test_completion_startup(tmp_path):
+    (tmp_path / "versions" / "3.8.2").mkdir(parents=True)
+    result, elapsed, imported = run_cli([], env={
+        "_DEV_COMPLETE": "complete",
+        "COMP_WORDS": "dev pythonpath -s 3.",
+        "COMP_CWORD": "3",
+        "PYENV_ROOT": str(tmp_path),
+    })
+    assert result.stdout.split() == [b"3.8.2"]
+    assert not imported & set(HEAVY_MODULES)
+    assert elapsed < STARTUP_BUDGET